@@ -2,31 +2,35 @@ import asyncio
 from datetime import date
 
 from sqlalchemy import select
-from db import async_session, init_db
+
+from db import init_db, dispose_engines, async_session
 from models import Holiday
+from holiday_import import DEFAULT_SCOPE, build_record, import_records
 
-async def add_today_holiday(name: str):
+async def add_today_holiday(name: str, scope: str = DEFAULT_SCOPE) -> int:
     await init_db()  # создаёт таблицы, если их нет
     today = date.today()
-    async with async_session() as session:
-        # Проверяем, есть ли уже такой праздник сегодня
-        result = await session.execute(
-            select(Holiday).where(Holiday.day == today.day, Holiday.month == today.month, Holiday.name == name)
-        )
-        existing = result.scalar_one_or_none()
-        if existing:
-            print(f"Праздник '{name}' на сегодня уже есть в базе.")
-            return
+    try:
+        # праздник определяется (scope, месяц, день, правило): импорт переименовал бы настоящий
+        # праздник сегодняшнего дня (1 января — «Новый год»), поэтому такой день не трогаем
+        async with async_session() as session:
+            existing = (await session.execute(
+                select(Holiday.id).where(Holiday.scope == scope, Holiday.month == today.month,
+                                         Holiday.day == today.day, Holiday.rule == "")
+            )).first()
+        if existing is not None:
+            print(f"На {today} в календаре {scope} уже есть праздник (id {existing.id}) — тестовый не добавлен.")
+            return 1
+        await import_records([build_record(today.month, today.day, {"ru": name}, scope=scope)])
+    finally:
+        await dispose_engines()
 
-        # Добавляем праздник
-        holiday = Holiday(name=name, day=today.day, month=today.month)
-        session.add(holiday)
-        await session.commit()
-        print(f"Добавлен праздник: '{name}' на {today}")
+    print(f"Добавлен праздник: '{name}' на {today}")
+    return 0
 
 if __name__ == "__main__":
     import sys
     name = "Тестовый праздник"
     if len(sys.argv) > 1:
         name = " ".join(sys.argv[1:])
-    asyncio.run(add_today_holiday(name))
+    sys.exit(asyncio.run(add_today_holiday(name)))
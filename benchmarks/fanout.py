@@ -0,0 +1,195 @@
+"""
+Рассылка праздника и дней рождения на синтетической базе: сколько длится прогон
+планировщика, сколько запросов к БД он делает и сколько памяти занимает.
+
+    python -m benchmarks.fanout --users 10000
+    python -m benchmarks.fanout --users 100000 --latency 0.05 --error-rate 0.01
+    python -m benchmarks.fanout --users 1000000 --dsn postgresql+asyncpg://... --no-tracemalloc
+
+Бот подменяется заглушкой (benchmarks.stub_bot) с заданной задержкой и долей ошибок.
+Праздники и дни рождения планируются одной задачей пояса (scheduler.plan_bucket),
+поэтому меряется именно она. Без --dsn используется временная SQLite-база.
+Результат печатается одной JSON-строкой в stdout, журнал прогона — в stderr.
+"""
+import argparse, asyncio, contextlib, json, os, random, resource, sys, tempfile, time, tracemalloc
+from datetime import date, timedelta
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--langs", default="ru=0.6,kk=0.3,en=0.1", help="доли языков пользователей")
+    parser.add_argument("--birthday-share", type=float, default=0.5, help="доля пользователей с датой рождения")
+    parser.add_argument("--birthday-today", type=float, default=0.01, help="доля из них, у кого ДР сегодня")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, завершающихся ошибкой")
+    parser.add_argument("--rate", type=float, default=1e9, help="глобальный лимит сообщений/с (по умолчанию без лимита)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-tracemalloc", action="store_true", help="не считать пик памяти (tracemalloc замедляет прогон)")
+    parser.add_argument("--dsn", help="база для замера (по умолчанию временная SQLite)")
+    return parser.parse_args(argv)
+
+
+def _parse_langs(spec: str) -> tuple:
+    pairs = [item.split("=") for item in spec.split(",") if item]
+    return tuple(lang for lang, _ in pairs), tuple(float(share) for _, share in pairs)
+
+
+async def _seed(args, today: date):
+    from sqlalchemy import insert, select, func, literal, String
+    from db import async_session
+    from models import User, UserScope, Holiday, HolidayTranslation
+    from calendar_cache import bump_calendar_version
+    from occurrences import refresh_occurrences
+
+    rnd = random.Random(args.seed)
+    langs, weights = _parse_langs(args.langs)
+    async with async_session() as session:
+        if not (await session.execute(select(Holiday.id).where(Holiday.type == "birthday"))).first():
+            birthday = Holiday(day=0, month=0, scope="bench", type="birthday")
+            session.add(birthday)
+            await session.flush()
+            session.add(HolidayTranslation(holiday_id=birthday.id, lang="ru", name="День рождения"))
+        # (scope, month, day, rule) уникален — при повторном прогоне на той же базе праздник уже есть
+        holiday = (await session.execute(select(Holiday).where(
+            Holiday.scope == "bench", Holiday.month == today.month, Holiday.day == today.day, Holiday.rule == "",
+        ))).scalar()
+        if holiday is None:
+            holiday = Holiday(day=today.day, month=today.month, scope="bench", type="regular")
+            session.add(holiday)
+            await session.flush()
+            for lang in langs:
+                session.add(HolidayTranslation(holiday_id=holiday.id, lang=lang, name=f"Bench {lang}"))
+            await refresh_occurrences(session, [holiday.id], today)
+        await bump_calendar_version(session)
+
+        start = (await session.execute(select(func.coalesce(func.max(User.tg_id), 0)))).scalar() + 1
+        chunk = 10000
+        for offset in range(0, args.users, chunk):
+            rows = []
+            for i in range(offset, min(offset + chunk, args.users)):
+                birthday = None
+                if rnd.random() < args.birthday_share:
+                    if rnd.random() < args.birthday_today:
+                        birthday = today.replace(year=2000) if (today.month, today.day) != (2, 29) else date(2000, 2, 29)
+                    else:
+                        birthday = date(2000, 1, 1) + timedelta(days=rnd.randrange(366))
+                # Core-вставка минует @validates, поэтому месяц и день пишем сами
+                rows.append({
+                    "tg_id": start + i,
+                    "name": f"bench{i}",
+                    "lang": rnd.choices(langs, weights)[0],
+                    "birthday": birthday,
+                    "birthday_month": birthday.month if birthday else None,
+                    "birthday_day": birthday.day if birthday else None,
+                })
+            await session.execute(insert(User), rows)
+        # праздник в календаре bench — подписываем на него всех синтетических пользователей
+        await session.execute(insert(UserScope).from_select(
+            ["scope", "user_id"], select(literal("bench", String), User.id).where(User.tg_id >= start),
+        ))
+        await session.commit()
+
+
+async def _delivered():
+    from sqlalchemy import select, func
+    from db import async_session
+    from models import Holiday, OutboxMessage
+
+    async with async_session() as session:
+        res = await session.execute(
+            select(Holiday.type, OutboxMessage.status, func.count())
+            .join(Holiday, Holiday.id == OutboxMessage.holiday_id)
+            .group_by(Holiday.type, OutboxMessage.status)
+        )
+        return {f"{kind}:{status}": count for kind, status, count in res.all()}
+
+
+async def run(args) -> dict:
+    import pytz
+    from datetime import datetime
+    from sqlalchemy import event
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from db import engine, init_db, dispose_engines
+    from calendar_cache import load_calendar
+    from sender import TokenBucket
+    import bot as bot_module
+    import scheduler
+    from benchmarks import stub_bot
+
+    try:
+        await init_db()
+        today = datetime.now(pytz.timezone(scheduler.TIMEZONE)).date()
+        seed_started = time.perf_counter()
+        await _seed(args, today)
+        seed_seconds = time.perf_counter() - seed_started
+        await load_calendar()
+
+        stub = stub_bot.install(bot_module.bot, bot_module.send_engine,
+                                latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+        bot_module.send_engine.global_bucket = TokenBucket(args.rate, args.rate)
+        scheduler.SEND_HOUR_START, scheduler.SEND_HOUR_END = 0, 24
+        # задачи поясов регистрируются в планировщике, который здесь не запускается
+        scheduler._scheduler = AsyncIOScheduler(timezone=scheduler.TIMEZONE)
+
+        queries = 0
+
+        def count_query(*_):
+            nonlocal queries
+            queries += 1
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+        if not args.no_tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        await scheduler.refresh_buckets()
+        await scheduler.drain_outbox()
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        tracemalloc.stop()
+        event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+
+        delivered = await _delivered()
+    finally:
+        await dispose_engines()
+
+    sent = bot_module.send_engine.sent
+    return {
+        "benchmark": "fanout",
+        "dialect": engine.dialect.name,
+        "users": args.users,
+        "langs": args.langs,
+        "birthday_share": args.birthday_share,
+        "birthday_today": args.birthday_today,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "seed_seconds": round(seed_seconds, 4),
+        "wall_seconds": round(wall, 4),
+        "messages_sent": sent,
+        "messages_per_sec": round(sent / wall, 1) if wall else None,
+        "api_requests": stub.requests,
+        "db_queries": queries,
+        "peak_traced_bytes": peak,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "outbox": delivered,
+        "send_engine": bot_module.send_engine.stats(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    if args.dsn:
+        os.environ["DB_DSN"] = args.dsn
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="holiday_bench_"), "bench.db")
+        os.environ["DB_DSN"] = f"sqlite+aiosqlite:///{path}"
+    # бот не ходит в Telegram, но Bot() требует токен правильного вида
+    os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+    # журнал планировщика уходит в stderr, в stdout — только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Нагрузка на обработчики бота: апдейты подаются в dp.feed_update с заданной частотой,
+ответы уходят в заглушку Bot API. Считаются задержки обработки (p50/p95/p99)
+и число запросов к БД на апдейт — в целом и по видам апдейтов.
+
+    python -m benchmarks.handlers --count 5000 --rate 200
+    python -m benchmarks.handlers --updates recorded.jsonl --rate 500 --dsn postgresql+asyncpg://...
+
+Без --updates апдейты синтетические: /start, кнопки меню на всех языках, дата
+рождения сообщением, колбэки lang:/bday:. С --spam-share долю апдейтов шлёт один
+пользователь, жмущий bday:view (вид spam), — с --throttle видно, защищает ли лимит
+на пользователя (throttle.py) остальных. Файл --updates — по одному JSON апдейта
+Telegram на строку. Без --dsn используется временная SQLite-база.
+Результат печатается одной JSON-строкой в stdout, журнал прогона — в stderr.
+"""
+import argparse, asyncio, contextlib, contextvars, itertools, json, os, random, sys, tempfile, time
+from datetime import datetime
+
+# вид апдейта, который сейчас обрабатывается, — чтобы относить запросы к БД
+_current_kind = contextvars.ContextVar("current_kind", default=None)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="сколько синтетических апдейтов подать")
+    parser.add_argument("--rate", type=float, default=200, help="целевая частота, апдейтов/с")
+    parser.add_argument("--users", type=int, default=500, help="сколько разных пользователей пишут боту")
+    parser.add_argument("--updates", help="файл с записанными апдейтами (JSON на строку)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки Bot API, с")
+    parser.add_argument("--keep-limits", action="store_true",
+                        help="оставить лимиты SendEngine (30/с на бота) — тогда меряется и ожидание очереди")
+    parser.add_argument("--spam-share", type=float, default=0.0,
+                        help="доля синтетических апдейтов от одного пользователя, повторяющего колбэк")
+    parser.add_argument("--throttle", action="store_true",
+                        help="включить лимит апдейтов на пользователя (по умолчанию выключен)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dsn", help="база для замера (по умолчанию временная SQLite)")
+    return parser.parse_args(argv)
+
+
+def _synthetic(args) -> list:
+    """Пары (вид, апдейт) в случайном порядке с фиксированным seed."""
+    from aiogram import types
+    from i18n import BUTTON_ACTIONS, LANGUAGES
+
+    rnd = random.Random(args.seed)
+    buttons = list(BUTTON_ACTIONS)
+    ids = itertools.count(1)
+    kinds = ("start", "button", "button", "button", "birthday", "lang", "bday")
+
+    def user(uid):
+        return types.User(id=uid, is_bot=False, first_name=f"U{uid}")
+
+    def message(uid, text):
+        return types.Message(
+            message_id=next(ids), date=datetime.now(),
+            chat=types.Chat(id=uid, type="private"), from_user=user(uid), text=text,
+        )
+
+    updates = []
+    for _ in range(args.count):
+        uid = 1_000_000 + rnd.randrange(args.users)
+        kind = rnd.choice(kinds)
+        if rnd.random() < args.spam_share:
+            uid, kind = 999_999, "spam"
+        if kind == "start":
+            update = types.Update(update_id=next(ids), message=message(uid, "/start"))
+        elif kind == "button":
+            update = types.Update(update_id=next(ids), message=message(uid, rnd.choice(buttons)))
+        elif kind == "birthday":
+            text = f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}"
+            update = types.Update(update_id=next(ids), message=message(uid, text))
+        else:
+            if kind == "spam":
+                data = "bday:view"
+            elif kind == "lang":
+                data = f"lang:{rnd.choice(LANGUAGES)}"
+            else:
+                data = f"bday:{rnd.choice(('view', 'set'))}"
+            update = types.Update(update_id=next(ids), callback_query=types.CallbackQuery(
+                id=str(next(ids)), chat_instance="bench", from_user=user(uid), data=data,
+                message=message(uid, "menu"),
+            ))
+        updates.append((kind, update))
+    return updates
+
+
+def _recorded(path: str, bot) -> list:
+    from aiogram import types
+
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                update = types.Update.model_validate(json.loads(line), context={"bot": bot})
+                updates.append((update.event_type, update))
+    return updates
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {"count": len(values), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(values[-1] * 1000, 3)}
+
+
+async def run(args) -> dict:
+    from sqlalchemy import event
+    from db import engine, init_db, dispose_engines
+    from calendar_cache import load_calendar
+    from user_cache import user_cache
+    from sender import TokenBucket
+    import bot as bot_module
+    from benchmarks import stub_bot
+
+    latencies = {}
+    queries = {}
+    errors = 0
+
+    def count_query(*_):
+        kind = _current_kind.get()
+        queries[kind] = queries.get(kind, 0) + 1
+
+    async def feed(kind, update):
+        nonlocal errors
+        _current_kind.set(kind)
+        started = time.perf_counter()
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, update)
+        except Exception as e:
+            errors += 1
+            print(f"Ошибка обработки {kind}: {e.__class__.__name__}: {e}")
+        latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    try:
+        await init_db()
+        await load_calendar()
+        stub = stub_bot.install(bot_module.bot, bot_module.send_engine, latency=args.latency, seed=args.seed)
+        if not args.keep_limits:
+            # иначе ответы упираются в лимиты Telegram, а не в обработчики
+            bot_module.send_engine.global_bucket = TokenBucket(1e9, 1e9)
+            bot_module.send_engine.chat_rate = bot_module.send_engine.chat_burst = 1e9
+        if not args.throttle:
+            bot_module.throttle.rate = 0
+        updates = _recorded(args.updates, bot_module.bot) if args.updates else _synthetic(args)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+        # открытая модель нагрузки: апдейт подаётся по расписанию, не дожидаясь предыдущих
+        interval = 1 / args.rate
+        tasks = []
+        started = time.perf_counter()
+        for i, (kind, update) in enumerate(updates):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(feed(kind, update)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+        event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+    finally:
+        await dispose_engines()
+
+    total = len(updates)
+    by_kind = {}
+    for kind, values in sorted(latencies.items()):
+        by_kind[kind] = _percentiles(values)
+        by_kind[kind]["db_queries_per_update"] = round(queries.get(kind, 0) / len(values), 3)
+    return {
+        "benchmark": "handlers",
+        "dialect": engine.dialect.name,
+        "updates": total,
+        "target_rate": args.rate,
+        "achieved_rate": round(total / wall, 1) if wall else None,
+        "wall_seconds": round(wall, 4),
+        "errors": errors,
+        "latency": _percentiles([v for values in latencies.values() for v in values]),
+        "db_queries": sum(queries.values()),
+        "db_queries_per_update": round(sum(queries.values()) / total, 3) if total else None,
+        "by_kind": by_kind,
+        "api_requests": stub.requests,
+        "user_cache": user_cache.stats(),
+        "throttle": bot_module.throttle.stats(),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    if args.dsn:
+        os.environ["DB_DSN"] = args.dsn
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="holiday_bench_"), "bench.db")
+        os.environ["DB_DSN"] = f"sqlite+aiosqlite:///{path}"
+    # бот не ходит в Telegram, но Bot() требует токен правильного вида
+    os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
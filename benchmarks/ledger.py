@@ -0,0 +1,132 @@
+"""
+Скорость записи строк notifications: ORM-путь (объект на пользователя и commit
+на каждую пачку BATCH_SIZE, как было в планировщике) против NotificationLedger.
+
+    python -m benchmarks.ledger --rows 20000
+    python -m benchmarks.ledger --rows 100000 --dsn postgresql+asyncpg://...
+
+Без --dsn используется временная SQLite-база, рабочая DB_DSN не трогается.
+Результат печатается одной JSON-строкой в stdout, журнал прогона — в stderr.
+"""
+import argparse, asyncio, contextlib, json, os, sys, tempfile, time
+from datetime import date
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=50, help="размер пачки ORM-пути (BATCH_SIZE)")
+    parser.add_argument("--flush-rows", type=int, default=500, help="порог сброса ledger")
+    parser.add_argument("--copy", action="store_true", help="COPY вместо INSERT на PostgreSQL")
+    parser.add_argument("--dsn", help="база для замера (по умолчанию временная SQLite)")
+    return parser.parse_args(argv)
+
+
+async def _seed(rows: int):
+    from sqlalchemy import insert, select, func
+    from db import async_session
+    from models import User, Holiday
+
+    async with async_session() as session:
+        # (scope, month, day) уникален — при повторном прогоне на той же базе праздник уже есть
+        holiday = (await session.execute(select(Holiday).where(
+            Holiday.scope == "bench", Holiday.month == 1, Holiday.day == 1,
+        ))).scalar()
+        if holiday is None:
+            holiday = Holiday(day=1, month=1, scope="bench", type="regular")
+            session.add(holiday)
+            await session.flush()
+        start = (await session.execute(select(func.coalesce(func.max(User.tg_id), 0)))).scalar() + 1
+        await session.execute(
+            insert(User),
+            [{"tg_id": start + i, "name": f"bench{i}", "lang": "ru"} for i in range(rows)],
+        )
+        await session.commit()
+        res = await session.execute(select(User.id).where(User.tg_id >= start).order_by(User.id))
+        return holiday.id, res.scalars().all()
+
+
+async def _reset(holiday_id: int):
+    from sqlalchemy import delete
+    from db import async_session
+    from models import Notification
+
+    async with async_session() as session:
+        await session.execute(delete(Notification).where(Notification.holiday_id == holiday_id))
+        await session.commit()
+
+
+async def bench_orm(user_ids, holiday_id: int, batch: int) -> float:
+    from db import async_session
+    from models import Notification
+
+    year = date.today().year
+    started = time.perf_counter()
+    async with async_session() as session:
+        for i in range(0, len(user_ids), batch):
+            session.add_all([
+                Notification(user_id=user_id, holiday_id=holiday_id, year=year)
+                for user_id in user_ids[i:i + batch]
+            ])
+            await session.commit()
+    return time.perf_counter() - started
+
+
+async def bench_ledger(user_ids, holiday_id: int, flush_rows: int, use_copy: bool) -> float:
+    from ledger import NotificationLedger
+
+    book = NotificationLedger(flush_rows=flush_rows, flush_interval=float("inf"), use_copy=use_copy)
+    started = time.perf_counter()
+    for user_id in user_ids:
+        book.add(user_id, holiday_id)
+        await book.maybe_flush()
+    await book.flush()
+    return time.perf_counter() - started
+
+
+async def run(args) -> dict:
+    from db import engine, init_db, dispose_engines
+
+    try:
+        await init_db()
+        holiday_id, user_ids = await _seed(args.rows)
+
+        orm_seconds = await bench_orm(user_ids, holiday_id, args.batch)
+        await _reset(holiday_id)
+        ledger_seconds = await bench_ledger(user_ids, holiday_id, args.flush_rows, args.copy)
+        await _reset(holiday_id)
+    finally:
+        await dispose_engines()
+
+    rows = len(user_ids)
+    return {
+        "benchmark": "ledger",
+        "dialect": engine.dialect.name,
+        "rows": rows,
+        "orm_batch": args.batch,
+        "ledger_flush_rows": args.flush_rows,
+        # COPY есть только на PostgreSQL — на других базах флаг ни на что не влияет
+        "copy": args.copy and engine.dialect.name == "postgresql",
+        "orm_seconds": round(orm_seconds, 4),
+        "ledger_seconds": round(ledger_seconds, 4),
+        "orm_rows_per_sec": round(rows / orm_seconds, 1),
+        "ledger_rows_per_sec": round(rows / ledger_seconds, 1),
+        "speedup": round(orm_seconds / ledger_seconds, 2),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    if args.dsn:
+        os.environ["DB_DSN"] = args.dsn
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="holiday_bench_"), "bench.db")
+        os.environ["DB_DSN"] = f"sqlite+aiosqlite:///{path}"
+    # журнал миграций уходит в stderr, в stdout — только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Сессия бота для замеров: запросы не уходят в Telegram, ответ приходит после
+заданной задержки, часть запросов можно «ронять» ошибками Telegram.
+"""
+import asyncio, random
+from datetime import datetime
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramForbiddenError, TelegramServerError
+from aiogram.methods import SendMessage, EditMessageText
+
+
+class StubSession(BaseSession):
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, permanent_share: float = 0.5, seed: int = 1):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.permanent_share = permanent_share
+        self.requests = 0
+        self._random = random.Random(seed)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            if self._random.random() < self.permanent_share:
+                raise TelegramForbiddenError(method, "bot was blocked by the user")
+            raise TelegramServerError(method, "Internal Server Error")
+
+        if isinstance(method, (SendMessage, EditMessageText)):
+            chat_id = getattr(method, "chat_id", None) or 0
+            return types.Message(
+                message_id=self.requests,
+                date=datetime.now(),
+                chat=types.Chat(id=chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        if False:
+            yield b""
+
+
+def install(bot, engine, **kwargs) -> StubSession:
+    """Подменяет сессию бота заглушкой с тем же движком лимитов (SendEngine)."""
+    session = StubSession(**kwargs)
+    session.middleware(engine)
+    bot.session = session
+    return session
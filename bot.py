@@ -1,112 +1,48 @@
-import os, re
-from datetime import date
+import os, re, pytz
+import calendar as calendar_module
+from datetime import date, datetime
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart, Command
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from dotenv import load_dotenv
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from db import async_session
-from models import User, Holiday
+from calendar_cache import get_calendar
+from user_cache import UserProfile, user_cache
+from users import upsert_user, set_scope, fresh_user, UserSessionMiddleware
+from throttle import ThrottleMiddleware
+from sender import SendEngine
+from response_cache import response_cache
+from metrics import registry, HandlerMetricsMiddleware
+from i18n import t, plural, LANGUAGES, MENU_BUTTONS, BUTTON_ACTIONS
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+MAX_NEXT_HOLIDAYS = int(os.getenv("MAX_NEXT_HOLIDAYS", 20))
+TIMEZONE = os.getenv("TIMEZONE", "Asia/Almaty")
+
 bot = Bot(BOT_TOKEN)
 dp = Dispatcher()
 
-# Локализация (добавлены кнопки и тексты для меню)
-MESSAGES = {
-    "start": {
-        "ru": "Привет! ✅ Ты зарегистрирован.",
-        "kk": "Сәлем! ✅ Сен тіркелдің.",
-        "en": "Hello! ✅ You are registered."
-    },
-    "help": {
-        "ru": "ℹ️ Команды:\n/next_holidays — 3 ближайших праздника\n/holidays — ближайший праздник\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_lang ru|kk|en",
-        "kk": "ℹ️ Командалар:\n/next_holidays — 3 жақын мереке\n/holidays — жақын мереке\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_lang ru|kk|en",
-        "en": "ℹ️ Commands:\n/next_holidays — 3 upcoming holidays\n/holidays — next holiday\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_lang ru|kk|en"
-    },
-    "lang_saved": {
-        "ru": "✅ Язык сохранён: {lang}",
-        "kk": "✅ Тіл сақталды: {lang}",
-        "en": "✅ Language saved: {lang}"
-    },
-
-    # ДР
-    "birthday_saved": {
-        "ru": "🎂 Дата рождения сохранена: {date}",
-        "kk": "🎂 Туған күн сақталды: {date}",
-        "en": "🎂 Birthday saved: {date}"
-    },
-    "birthday_show": {
-        "ru": "📅 Твоя дата рождения: {date}",
-        "kk": "📅 Сенің туған күнің: {date}",
-        "en": "📅 Your birthday: {date}"
-    },
-    "birthday_cleared": {
-        "ru": "❌ Дата рождения удалена",
-        "kk": "❌ Туған күн өшірілді",
-        "en": "❌ Birthday cleared"
-    },
-    "birthday_not_set": {
-        "ru": "⚠️ Дата рождения не установлена",
-        "kk": "⚠️ Туған күн орнатылмаған",
-        "en": "⚠️ Birthday not set"
-    },
-
-    #next holidays
-    "holiday_today": {"ru": "🎉 Сегодня праздник: {name}!",
-                      "kk": "🎉 Бүгін мереке: {name}!",
-                      "en": "🎉 Today is holiday: {name}!"},
-    "holiday_tomorrow": {"ru": "🎊 Завтра праздник: {name}!",
-                         "kk": "🎊 Ертең мереке: {name}!",
-                         "en": "🎊 Tomorrow is holiday: {name}!"},
-    "holiday_future": {"ru": "⏳ До праздника «{name}» осталось {delta} {days_word}\n📅 {date}",
-                       "kk": "⏳ «{name}» мерекесіне дейін {delta} {days_word} қалды\n📅 {date}",
-                       "en": "⏳ {delta} {days_word} left until «{name}»\n📅 {date}"},
-    "next_holidays_header": {"ru": "📅 Ближайшие праздники:",
-                             "kk": "📅 Жақын мерекелер:",
-                             "en": "📅 Upcoming holidays:"},
-    "no_holidays": {"ru": "⚠️ Нет ближайших праздников",
-                    "kk": "⚠️ Жақын мерекелер жоқ",
-                    "en": "⚠️ No upcoming holidays"},
-
-    # Кнопки главного меню
-    "btn_holidays": {"ru": "📅 Праздники", "kk": "📅 Мерекелер", "en": "📅 Holidays"},
-    "btn_next3": {"ru": "🗓️ 3 ближайших", "kk": "🗓️ 3 жақын", "en": "🗓️ Next 3"},
-    "btn_lang": {"ru": "🌐 Язык", "kk": "🌐 Тіл", "en": "🌐 Language"},
-    "btn_birthday": {"ru": "🎂 Мой ДР", "kk": "🎂 Туған күнім", "en": "🎂 My bday"},
-
-    # Меню по ДР (inline)
-    "bday_menu_title": {"ru": "Управление ДР:", "kk": "Туған күн басқару:", "en": "Birthday menu:"},
-    "btn_bday_set": {"ru": "Установить ДР", "kk": "Туған күн қою", "en": "Set birthday"},
-    "btn_bday_view": {"ru": "Показать ДР", "kk": "Туған күн көрсету", "en": "View birthday"},
-    "btn_bday_clear": {"ru": "Удалить ДР", "kk": "Жою", "en": "Clear birthday"},
-    "bday_set_instructions": {
-        "ru": "Чтобы установить ДР, используй команду: DD-MM или DD-MM-YYYY(год можно не указывать).",
-        "kk": "Туған күнді орнату үшін: DD-MM немесе DD-MM-YYYY (жылды көрсетпеуге болады).",
-        "en": "To set birthday: DD-MM or DD-MM-YYYY (year optional)."
-    },
-
-    # language chooser prompt
-    "choose_language_prompt": {
-        "ru": "Выберите язык:", "kk": "Тілді таңдаңыз:", "en": "Choose language:"},
-    "birthday_notifications": {
-        "ru": "🎉 Сегодня у тебя день рождения! С днём рождения, {user.name}! 🥳\n",
-        "kk": "🎉 Бүгін сенің туған күнің! Құтты болсын, {user.name}! 🥳\n",
-        "en": "🎉 Today is your birthday! Happy birthday, {user.name}! 🥳"
-    },
-}
+# Все исходящие запросы бота (и ответы в хендлерах, и рассылки) идут через один движок лимитов
+send_engine = SendEngine()
+bot.session.middleware(send_engine)
+registry.register_stats("send", send_engine.stats,
+                        counters=("attempts", "sent", "retries", "flood_waits", "failed_retryable", "failed_permanent"))
+registry.register_stats("user_cache", user_cache.stats, counters=("hits", "misses"))
+registry.register_stats("response_cache", response_cache.stats, counters=("hits", "misses", "coalesced"))
 
+# лимит апдейтов на пользователя и склейка повторов — раньше, чем апдейт займёт сессию БД
+throttle = ThrottleMiddleware()
+registry.register_stats("throttle", throttle.stats, counters=("passed", "delayed", "dropped", "coalesced"))
+dp.message.outer_middleware(throttle)
+dp.callback_query.outer_middleware(throttle)
 
-def t(key, locale="ru", **kwargs):
-    translations = MESSAGES.get(key, {})
-    text = translations.get(locale) or translations.get("ru") or next(iter(translations.values()), "")
-    try:
-        return text.format(**kwargs)
-    except Exception:
-        return text
+# одна сессия БД и профиль отправителя на апдейт: хендлеры получают session и user
+dp.message.outer_middleware(UserSessionMiddleware())
+dp.callback_query.outer_middleware(UserSessionMiddleware())
+# время обработки по хендлерам
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
 
 
 def _parse_birthday_arg(arg: str) -> date:
@@ -125,138 +61,122 @@ def _parse_birthday_arg(arg: str) -> date:
     return date(year=int(y), month=int(m), day=int(d))
 
 
-async def _get_or_create_user(tg_id: int, full_name: str) -> User:
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == tg_id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=tg_id, name=full_name)
-            session.add(user)
-            await session.commit()
-        return user
-
-
-async def _get_holiday_translations():
-    async with async_session() as session:
-        res = await session.execute(
-            select(Holiday).options(selectinload(Holiday.translations)).order_by(Holiday.month, Holiday.day)
-        )
-        return res.scalars().all()
+def _local_today(user: UserProfile) -> date:
+    # «сегодня» в часовом поясе пользователя
+    return datetime.now(pytz.timezone(user.tz or TIMEZONE)).date()
 
 
 def _format_holiday_name(holiday, lang: str) -> str:
-    # 1. Ищем перевод на языке пользователя
-    for tr in holiday.translations:
-        if tr.lang == lang:
-            return tr.name
-    # 2. fallback по приоритету (ru → kk → en)
-    fallback_priority = ["kk", "ru", "en"]
-    for fb in fallback_priority:
-        for tr in holiday.translations:
-            if tr.lang == fb:
-                return tr.name
+    # перевод с запасными языками уже разрешён при загрузке календаря (HolidayEntry.names)
+    return holiday.name(lang)
 
-    # 3. если вообще ничего нет — название "Holiday"
-    return "Holiday"
 
+# Клавиатуры не зависят от пользователя — собираем по одной на язык и переиспользуем
+_keyboards = {}
 
 
 def build_main_kb(locale: str):
-    kb = ReplyKeyboardBuilder()
-    kb.button(text=t("btn_holidays", locale))
-    kb.button(text=t("btn_next3", locale))
-    kb.button(text=t("btn_lang", locale))
-    kb.button(text=t("btn_birthday", locale))
-    kb.adjust(2)
-    return kb.as_markup(resize_keyboard=True)
+    markup = _keyboards.get(("main", locale))
+    if markup is None:
+        kb = ReplyKeyboardBuilder()
+        for key in MENU_BUTTONS:
+            kb.button(text=t(key, locale))
+        kb.adjust(2)
+        markup = _keyboards["main", locale] = kb.as_markup(resize_keyboard=True)
+    return markup
+
+
+def build_lang_kb():
+    markup = _keyboards.get(("lang", None))
+    if markup is None:
+        kb = InlineKeyboardBuilder()
+        for lang in LANGUAGES:
+            kb.button(text=t("language_name", lang), callback_data=f"lang:{lang}")
+        kb.adjust(1)
+        markup = _keyboards["lang", None] = kb.as_markup()
+    return markup
+
+
+def build_bday_kb(locale: str):
+    markup = _keyboards.get(("bday", locale))
+    if markup is None:
+        kb = InlineKeyboardBuilder()
+        kb.button(text=t("btn_bday_view", locale), callback_data="bday:view")
+        kb.button(text=t("btn_bday_set", locale), callback_data="bday:set")
+        kb.button(text=t("btn_bday_clear", locale), callback_data="bday:clear")
+        kb.adjust(1)
+        markup = _keyboards["bday", locale] = kb.as_markup()
+    return markup
 
 
 @dp.message(CommandStart())
-async def start(message: types.Message):
-    user = await _get_or_create_user(message.from_user.id, message.from_user.full_name)
+async def start(message: types.Message, user: UserProfile):
     await message.answer(t("start", user.lang), reply_markup=build_main_kb(user.lang))
 
 
 @dp.message(Command("help"))
-async def help_cmd(message: types.Message):
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
-        lang = user.lang if user else "ru"
-    await message.answer(t("help", lang))
+async def help_cmd(message: types.Message, user: UserProfile):
+    await message.answer(t("help", user.lang))
 
 
-# Команда ближайшего праздника
-@dp.message(Command("holidays"))
-async def holidays_cmd(message: types.Message):
-    # reuse logic (works both for command and button via default_handler)
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one()
-    holidays = await _get_holiday_translations()
-    if not holidays:
-        await message.answer(t("no_holidays", user.lang))
-        return
-
-    today = date.today()
-    next_item = None
-    for h in holidays:
-        # игнорируем некорректные даты
-        if not (1 <= h.month <= 12 and 1 <= h.day <= 31):
-            continue
-        try:
-            h_date = date(today.year, h.month, h.day)
-        except ValueError:
-            continue
-        if h_date >= today:
-            next_item = (h, h_date)
-            break
-
-    if not next_item:
-        h = holidays[0]
-        h_date = date(today.year + 1, h.month, h.day)
-        next_item = (h, h_date)
-
-    h, h_date = next_item
+def _holiday_text(h, h_date: date, today: date, lang: str) -> str:
     delta = (h_date - today).days
-    name = _format_holiday_name(h, user.lang)
+    name = _format_holiday_name(h, lang)
 
     if delta == 0:
-        text = t("holiday_today", user.lang, name=name)
-    elif delta == 1:
-        text = t("holiday_tomorrow", user.lang, name=name)
-    else:
-        # подставляем слово для дней
-        if user.lang == "kk":
-            day_word = "күн"
-        elif user.lang == "en":
-            day_word = "day" if delta == 1 else "days"
-        else:
-            day_word = "день" if delta == 1 else "дней"
+        return t("holiday_today", lang, name=name)
+    if delta == 1:
+        return t("holiday_tomorrow", lang, name=name)
+
+    return t("holiday_future", lang,
+             name=name,
+             delta=delta,
+             days_word=plural("days_word", delta, lang),
+             date=h_date.strftime("%d-%m-%Y"))
+
+
+def _holiday_lines(items, today: date, lang: str) -> list:
+    lines = []
+    for h, h_date in items:
+        delta = (h_date - today).days
+        text = _holiday_text(h, h_date, today, lang)
+        if delta == 0:
+            text = f"🎉 {text}"
+        elif delta == 1:
+            text = f"🎊 {text}"
+        lines.append(text)
+    return lines
+
 
-        text = t("holiday_future", user.lang,
-                 name=name,
-                 delta=delta,
-                 days_word=day_word,
-                 date=h_date.strftime("%d-%m-%Y"))
+# Команда ближайшего праздника
+@dp.message(Command("holidays"))
+async def holidays_cmd(message: types.Message, user: UserProfile):
+    # reuse logic (works both for command and button via default_handler)
+    lang, today = user.lang, _local_today(user)
+    calendar = await get_calendar()
+    # только календари, на которые подписан пользователь; вид кэшируется в снимке
+    view = calendar.view(user.scopes)
 
-    await message.answer(text)
+    async def render():
+        next_item = view.index.next_on_or_after(today)
+        if not next_item:
+            return t("no_holidays", lang)
+        h, h_date = next_item
+        return _holiday_text(h, h_date, today, lang)
+
+    await message.answer(await response_cache.get((today, lang, view.scopes, "holidays"), render, calendar.version))
 
 
 # Callback для выбора языка
 @dp.callback_query(lambda c: c.data and c.data.startswith("lang:"))
-async def lang_callback(cb: types.CallbackQuery):
+async def lang_callback(cb: types.CallbackQuery, session, user: UserProfile):
     lang = cb.data.split(":", 1)[1]
     user_id = cb.from_user.id
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == user_id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=user_id, name=cb.from_user.full_name)
-            session.add(user)
-            await session.commit()
-        user.lang = lang
-        await session.commit()
+    if lang not in LANGUAGES:
+        await cb.answer()
+        return
+    await upsert_user(session, user_id, user.name, lang=lang)
+    await session.commit()
 
     await cb.answer()  # убрать "loading"
     # удаляем старое inline-сообщение и высылаем подтверждение + новое главное меню на выбранном языке
@@ -270,19 +190,13 @@ async def lang_callback(cb: types.CallbackQuery):
 
 # Callback для меню ДР
 @dp.callback_query(lambda c: c.data and c.data.startswith("bday:"))
-async def bday_callback(cb: types.CallbackQuery):
+async def bday_callback(cb: types.CallbackQuery, session, user: UserProfile):
     action = cb.data.split(":", 1)[1]
-    user_id = cb.from_user.id
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == user_id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=user_id, name=cb.from_user.full_name)
-            session.add(user)
-            await session.commit()
-        lang = user.lang if user else "ru"
-
+    lang = user.lang
     if action == "view":
+        # дата могла измениться через другой экземпляр бота — кэшу профиля здесь не верим
+        user = await fresh_user(session, user)
+        await session.commit()
         if user.birthday:
             await cb.message.edit_text(t("birthday_show", lang, date=user.birthday.strftime("%d-%m")))
         else:
@@ -290,76 +204,69 @@ async def bday_callback(cb: types.CallbackQuery):
     elif action == "set":
         await cb.message.edit_text(t("bday_set_instructions", lang))
     elif action == "clear":
-        if user.birthday:
-            async with async_session() as session:
-                res = await session.execute(select(User).where(User.tg_id == user_id))
-                u = res.scalar_one()
-                u.birthday = None
-                await session.commit()
-            await cb.message.edit_text(t("birthday_cleared", lang))
-        else:
-            await cb.message.edit_text(t("birthday_not_set", lang))
+        user = await fresh_user(session, user, for_update=True)
+        cleared = user.birthday is not None
+        if cleared:
+            await upsert_user(session, cb.from_user.id, user.name, birthday=None)
+        # блокировка строки снимается до обращения к Telegram
+        await session.commit()
+        await cb.message.edit_text(t("birthday_cleared" if cleared else "birthday_not_set", lang))
     await cb.answer()
 
-# 3 ближайших праздника
+async def _answer_next_holidays(message: types.Message, user: UserProfile, count: int):
+    lang, today = user.lang, _local_today(user)
+    calendar = await get_calendar()
+    view = calendar.view(user.scopes)
+
+    async def render():
+        upcoming = view.index.next_n(today, count)
+        if not upcoming:
+            return t("no_holidays", lang)
+        lines = [t("next_holidays_header", lang)] + _holiday_lines(upcoming, today, lang)
+        return "\n\n".join(lines)
+
+    await message.answer(await response_cache.get((today, lang, view.scopes, "next", count), render, calendar.version))
+
+
+# N ближайших праздников (по умолчанию 3): /next_holidays [N]
 @dp.message(Command("next_holidays"))
-async def next_holidays(message: types.Message):
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one()
-    holidays = await _get_holiday_translations()
-    if not holidays:
-        await message.answer(t("no_holidays", user.lang))
-        return
+async def next_holidays(message: types.Message, user: UserProfile):
+    parts = (message.text or "").split()
+    count = 3
+    if len(parts) > 1 and parts[1].isdigit():
+        count = min(max(int(parts[1]), 1), MAX_NEXT_HOLIDAYS)
+    await _answer_next_holidays(message, user, count)
 
-    today = date.today()
-    upcoming = []
-    for h in holidays:
-        # проверяем корректность даты
-        if not (1 <= h.month <= 12 and 1 <= h.day <= 31):
-            continue
-        try:
-            h_date = date(today.year, h.month, h.day)
-        except ValueError:
-            continue
-        if h_date < today:
-            h_date = date(today.year + 1, h.month, h.day)
-        upcoming.append((h, h_date))
-
-    # сортируем по дате
-    upcoming.sort(key=lambda x: x[1])
-    top3 = upcoming[:3]
-
-    lines = [t("next_holidays_header", user.lang)]
-    for h, h_date in top3:
-        delta = (h_date - today).days
-        name = _format_holiday_name(h, user.lang)
 
-        if delta == 0:
-            lines.append(f"🎉 {t('holiday_today', user.lang, name=name)}")
-        elif delta == 1:
-            lines.append(f"🎊 {t('holiday_tomorrow', user.lang, name=name)}")
-        else:
-            if user.lang == "kk":
-                day_word = "күн"
-            elif user.lang == "en":
-                day_word = "day" if delta == 1 else "days"
-            else:
-                day_word = "день" if delta == 1 else "дней"
-
-            lines.append(
-                t("holiday_future", user.lang,
-                  name=name,
-                  delta=delta,
-                  days_word=day_word,
-                  date=h_date.strftime("%d-%m-%Y"))
-            )
-
-    await message.answer("\n\n".join(lines))
+async def next3_holidays(message: types.Message, user: UserProfile):
+    # кнопка меню: число задано кнопкой, а не разбором её (переведённого) текста
+    await _answer_next_holidays(message, user, 3)
+
+
+async def next10_holidays(message: types.Message, user: UserProfile):
+    await _answer_next_holidays(message, user, 10)
+
+
+# Праздники до конца текущего месяца
+@dp.message(Command("month_holidays"))
+async def month_holidays(message: types.Message, user: UserProfile):
+    lang, today = user.lang, _local_today(user)
+    calendar = await get_calendar()
+    view = calendar.view(user.scopes)
+
+    async def render():
+        month_end = date(today.year, today.month, calendar_module.monthrange(today.year, today.month)[1])
+        items = view.index.between(today, month_end)
+        if not items:
+            return t("no_holidays_month", lang)
+        lines = [t("month_holidays_header", lang)] + _holiday_lines(items, today, lang)
+        return "\n\n".join(lines)
+
+    await message.answer(await response_cache.get((today, lang, view.scopes, "month"), render, calendar.version))
 
 # Стандартные команды для работы с ДР (как раньше)
 @dp.message(Command("set_birthday"))
-async def set_birthday_cmd(message: types.Message):
+async def set_birthday_cmd(message: types.Message, session, user: UserProfile):
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
         await message.answer("❌ Укажи дату: DD-MM или DD-MM-YYYY (точка и / тоже поддерживаются)")
@@ -371,54 +278,86 @@ async def set_birthday_cmd(message: types.Message):
         await message.answer("⚠️ Неверный формат. Пример: 28-08 или 28.08.2000")
         return
 
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
+    user = await upsert_user(session, message.from_user.id, user.name, birthday=birthday)
+    await session.commit()
+    await message.answer(t("birthday_saved", user.lang, date=birthday.strftime("%d-%m-%Y")))
 
-        if not user:
-            user = User(tg_id=message.from_user.id, name=message.from_user.full_name)
-            session.add(user)
-            await session.commit()
 
-        user.birthday = birthday
-        await session.commit()
+@dp.message(Command("my_birthday"))
+async def my_birthday_cmd(message: types.Message, session, user: UserProfile):
+    user = await fresh_user(session, user)
+    await session.commit()
+    if user.birthday:
+        await message.answer(t("birthday_show", user.lang, date=user.birthday.strftime("%d-%m-%Y")))
+    else:
+        await message.answer(t("birthday_not_set", user.lang))
 
-    await message.answer(t("birthday_saved", user.lang, date=birthday.strftime("%d-%m-%Y")))
 
+@dp.message(Command("set_tz"))
+async def set_tz_cmd(message: types.Message, session, user: UserProfile):
+    parts = (message.text or "").split(maxsplit=1)
+    tz_name = parts[1].strip() if len(parts) > 1 else ""
+    if tz_name not in pytz.all_timezones_set:
+        await message.answer(t("tz_invalid", user.lang))
+        return
 
-@dp.message(Command("my_birthday"))
-async def my_birthday_cmd(message: types.Message):
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=message.from_user.id, name=message.from_user.full_name)
-            session.add(user)
-            await session.commit()
-        if user.birthday:
-            await message.answer(t("birthday_show", user.lang, date=user.birthday.strftime("%d-%m-%Y")))
-        else:
-            await message.answer(t("birthday_not_set", user.lang))
+    await upsert_user(session, message.from_user.id, user.name, tz=tz_name)
+    await session.commit()
+    await message.answer(t("tz_saved", user.lang, tz=tz_name))
+
+
+def build_scopes_kb(available, subscribed):
+    # отметки зависят от подписок пользователя, поэтому клавиатура не кэшируется
+    kb = InlineKeyboardBuilder()
+    for scope in available:
+        mark = "✅" if scope in subscribed else "▫️"
+        kb.button(text=f"{mark} {scope}", callback_data=f"scope:{scope}")
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+def _scopes_text(user: UserProfile) -> str:
+    return t("scopes_title", user.lang, scopes=", ".join(user.scopes) or t("scopes_none", user.lang))
+
+
+# Подписки на календари (Holiday.scope): страна, регион, религия, компания
+@dp.message(Command("scopes"))
+async def scopes_cmd(message: types.Message, user: UserProfile):
+    calendar = await get_calendar()
+    await message.answer(_scopes_text(user), reply_markup=build_scopes_kb(calendar.scopes, user.scopes))
+
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("scope:"))
+async def scope_callback(cb: types.CallbackQuery, session, user: UserProfile):
+    scope = cb.data.split(":", 1)[1]
+    calendar = await get_calendar()
+    # направление переключения — по подпискам из БД, а не из кэша профиля этого процесса
+    user = await fresh_user(session, user, for_update=True)
+    subscribe = scope not in user.scopes
+    # подписаться можно только на существующий календарь, отписаться — от любого
+    if subscribe and scope not in calendar.scopes:
+        await session.commit()
+        await cb.answer()
+        return
+    user = await set_scope(session, user, scope, subscribe)
+    await session.commit()
+
+    await cb.answer(t("scope_on" if subscribe else "scope_off", user.lang, scope=scope))
+    await cb.message.edit_text(_scopes_text(user), reply_markup=build_scopes_kb(calendar.scopes, user.scopes))
 
 
 @dp.message(Command("clear_birthday"))
-async def clear_birthday_cmd(message: types.Message):
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=message.from_user.id, name=message.from_user.full_name)
-            session.add(user)
-            await session.commit()
-        if user.birthday:
-            user.birthday = None
-            await session.commit()
-            await message.answer(t("birthday_cleared", user.lang))
-        else:
-            await message.answer(t("birthday_not_set", user.lang))
+async def clear_birthday_cmd(message: types.Message, session, user: UserProfile):
+    user = await fresh_user(session, user, for_update=True)
+    cleared = user.birthday is not None
+    if cleared:
+        await upsert_user(session, message.from_user.id, user.name, birthday=None)
+    # блокировка строки снимается до обращения к Telegram
+    await session.commit()
+    await message.answer(t("birthday_cleared" if cleared else "birthday_not_set", user.lang))
 
 @dp.message(lambda m: re.match(r"^\s*\d{1,2}[./-]\d{1,2}([./-]\d{2,4})?\s*$", m.text or ""))
-async def catch_birthday(message: types.Message):
+async def catch_birthday(message: types.Message, session, user: UserProfile):
     """
     Позволяет пользователю указать дату рождения простым сообщением
     """
@@ -441,77 +380,39 @@ async def catch_birthday(message: types.Message):
         await message.answer("⚠️ Формат даты: 28-08 или 28-08-2000")
         return
 
-    # ищем пользователя
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
-        if not user:
-            user = User(tg_id=message.from_user.id, name=message.from_user.full_name)
-            session.add(user)
-            await session.commit()
-
-        user.birthday = birthday
-        await session.commit()
-
-    lang = user.lang if user else "ru"
+    user = await upsert_user(session, message.from_user.id, user.name, birthday=birthday)
+    await session.commit()
     await message.answer(
-        t("birthday_saved", lang, date=birthday.strftime("%d-%m-%Y"))
+        t("birthday_saved", user.lang, date=birthday.strftime("%d-%m-%Y"))
     )
 
-# Показываем меню выбора языка (inline)
+
+async def lang_menu(message: types.Message, user: UserProfile):
+    await message.answer(t("choose_language_prompt", user.lang) + "\n", reply_markup=build_lang_kb())
+
+
+async def bday_menu(message: types.Message, user: UserProfile):
+    await message.answer(t("bday_menu_title", user.lang), reply_markup=build_bday_kb(user.lang))
+
+
+# Действия кнопок главного меню; текст кнопки -> действие берётся из BUTTON_ACTIONS
+_MENU_HANDLERS = {
+    "holidays": holidays_cmd,
+    "next3": next3_holidays,
+    "next10": next10_holidays,
+    "month": month_holidays,
+    "lang_menu": lang_menu,
+    "bday_menu": bday_menu,
+}
+
+
 @dp.message()
-async def default_handler(message: types.Message):
-    text = (message.text or "").strip()
-
-    # получаем user.lang (если есть)
-    async with async_session() as session:
-        res = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = res.scalar_one_or_none()
-    user_lang = user.lang if user else "ru"
-
-    # Сопоставление локализованных кнопок с действиями
-    btn_map = {
-        t("btn_holidays", "ru"): holidays_cmd,
-        t("btn_holidays", "kk"): holidays_cmd,
-        t("btn_holidays", "en"): holidays_cmd,
-
-        t("btn_next3", "ru"): next_holidays,
-        t("btn_next3", "kk"): next_holidays,
-        t("btn_next3", "en"): next_holidays,
-
-        t("btn_lang", "ru"): "lang_menu",
-        t("btn_lang", "kk"): "lang_menu",
-        t("btn_lang", "en"): "lang_menu",
-
-        t("btn_birthday", "ru"): "bday_menu",
-        t("btn_birthday", "kk"): "bday_menu",
-        t("btn_birthday", "en"): "bday_menu",
-    }
-
-    # если нажата одна из кнопок — вызовем соответствующий обработчик
-    if text in btn_map:
-        action = btn_map[text]
-        if callable(action):
-            await action(message)
-            return
-        if action == "lang_menu":
-            # show inline language chooser
-            kb = InlineKeyboardBuilder()
-            kb.button(text="Русский 🇷🇺", callback_data="lang:ru")
-            kb.button(text="Қазақша 🇰🇿", callback_data="lang:kk")
-            kb.button(text="English 🇬🇧", callback_data="lang:en")
-            kb.adjust(1)
-            await message.answer(t("choose_language_prompt", user_lang) + "\n", reply_markup=kb.as_markup())
-            return
-        if action == "bday_menu":
-            # show birthday inline menu
-            kb = InlineKeyboardBuilder()
-            kb.button(text=t("btn_bday_view", user_lang), callback_data="bday:view")
-            kb.button(text=t("btn_bday_set", user_lang), callback_data="bday:set")
-            kb.button(text=t("btn_bday_clear", user_lang), callback_data="bday:clear")
-            kb.adjust(1)
-            await message.answer(t("bday_menu_title", user_lang), reply_markup=kb.as_markup())
-            return
+async def default_handler(message: types.Message, user: UserProfile):
+    # нажата кнопка меню (на любом языке) — один поиск в словаре
+    action = BUTTON_ACTIONS.get((message.text or "").strip())
+    if action is not None:
+        await _MENU_HANDLERS[action](message, user)
+        return
 
     # если текст не обработан — показать help (локализованный)
-    await message.answer(t("help", user_lang))
+    await message.answer(t("help", user.lang))
@@ -0,0 +1,194 @@
+import asyncio, os, time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from types import MappingProxyType
+from sqlalchemy import select, update, insert
+from sqlalchemy.orm import selectinload
+from db import read_session
+from models import Holiday, HolidayOccurrence, CalendarVersion
+from holiday_index import HolidayIndex
+from i18n import LANGUAGES
+
+# Как часто (в секундах) сверять версию календаря с БД
+CALENDAR_CHECK_INTERVAL = float(os.getenv("CALENDAR_CHECK_INTERVAL", 60))
+
+# Если перевода на язык пользователя нет — берём первый найденный по этому порядку
+NAME_FALLBACK = ("kk", "ru", "en")
+DEFAULT_HOLIDAY_NAME = "Holiday"
+
+
+@dataclass(frozen=True, slots=True)
+class TranslationEntry:
+    lang: str
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class HolidayEntry:
+    id: int
+    day: int
+    month: int
+    scope: str
+    type: str
+    rule: str
+    translations: tuple
+    # язык -> название с уже применённым NAME_FALLBACK (для всех языков бота и переводов)
+    names: MappingProxyType = field(compare=False, repr=False)
+    fallback_name: str = field(compare=False, repr=False)
+
+    @classmethod
+    def from_model(cls, holiday: Holiday) -> "HolidayEntry":
+        translations = tuple(TranslationEntry(tr.lang, tr.name) for tr in holiday.translations)
+        own = {}
+        for tr in translations:
+            own.setdefault(tr.lang, tr.name)
+        fallback_name = next((own[lang] for lang in NAME_FALLBACK if lang in own), DEFAULT_HOLIDAY_NAME)
+        names = {lang: own.get(lang, fallback_name) for lang in (*LANGUAGES, *own)}
+        return cls(
+            id=holiday.id,
+            day=holiday.day,
+            month=holiday.month,
+            scope=holiday.scope,
+            type=holiday.type,
+            rule=holiday.rule,
+            translations=translations,
+            names=MappingProxyType(names),
+            fallback_name=fallback_name,
+        )
+
+    def name(self, lang: str) -> str:
+        return self.names.get(lang, self.fallback_name)
+
+
+class CalendarView:
+    """Даты обычных праздников снимка из части календарей (scope): свой индекс и разбивка по дням."""
+    __slots__ = ("scopes", "index", "_by_date")
+
+    def __init__(self, scopes: tuple, occurrences):
+        self.scopes = scopes
+        self.index = HolidayIndex(occurrences)
+        by_date = {}
+        for h_date, h in self.index:
+            by_date.setdefault(h_date, []).append(h)
+        self._by_date = MappingProxyType({k: tuple(v) for k, v in by_date.items()})
+
+    def on(self, day: date) -> tuple:
+        """Праздники на указанную дату."""
+        return self._by_date.get(day, ())
+
+
+class Calendar(CalendarView):
+    """
+    Неизменяемый снимок таблицы holidays вместе с переводами и датами из holiday_occurrences.
+    Читатели получают ссылку на снимок целиком, поэтому перезагрузка
+    никогда не показывает им наполовину собранный календарь.
+    Сам снимок — вид на все календари; view(scopes) даёт вид на часть из них.
+    """
+    __slots__ = ("version", "holidays", "by_id", "birthday", "_views")
+
+    def __init__(self, version: int, holidays, occurrences=()):
+        """occurrences — пары (date, holiday_id); даты праздников, которых нет в снимке, пропускаются."""
+        holidays = tuple(holidays)
+        by_id = {h.id: h for h in holidays}
+        regular = [(d, by_id[hid]) for d, hid in occurrences
+                   if hid in by_id and by_id[hid].type != "birthday"]
+        super().__init__(tuple(sorted({h.scope for h in holidays if h.type != "birthday"})), regular)
+
+        self.version = version
+        self.holidays = holidays
+        self.by_id = MappingProxyType(by_id)
+        self.birthday = next((h for h in holidays if h.type == "birthday"), None)
+        # набор scope -> CalendarView; живёт вместе со снимком, поэтому сбрасывать не нужно
+        self._views = {}
+
+    def view(self, scopes) -> CalendarView:
+        """Вид на праздники из календарей scopes (например, подписок пользователя); кэшируется."""
+        scopes = tuple(sorted(scopes))
+        view = self._views.get(scopes)
+        if view is None:
+            wanted = set(scopes)
+            view = self._views[scopes] = CalendarView(
+                scopes, ((d, h) for d, h in self.index if h.scope in wanted)
+            )
+        return view
+
+
+_calendar: Calendar | None = None
+_checked_at = 0.0
+_stale = False
+_lock = asyncio.Lock()
+
+
+async def _read_version(session) -> int:
+    res = await session.execute(select(CalendarVersion.version).where(CalendarVersion.id == 1))
+    return res.scalar_one_or_none() or 0
+
+
+async def load_calendar() -> Calendar:
+    """Полностью перечитывает календарь и атомарно подменяет снимок."""
+    global _calendar, _checked_at, _stale
+    # вчера по UTC: в части поясов этот день ещё не закончился
+    start = datetime.now(timezone.utc).date() - timedelta(days=1)
+    async with read_session() as session:
+        version = await _read_version(session)
+        res = await session.execute(
+            select(Holiday).options(selectinload(Holiday.translations)).order_by(Holiday.month, Holiday.day)
+        )
+        entries = [HolidayEntry.from_model(h) for h in res.scalars().all()]
+        # даты праздников — один диапазонный запрос по первичному ключу (date, holiday_id)
+        res = await session.execute(
+            select(HolidayOccurrence.date, HolidayOccurrence.holiday_id)
+            .where(HolidayOccurrence.date >= start)
+            .order_by(HolidayOccurrence.date, HolidayOccurrence.holiday_id)
+        )
+        occurrences = res.all()
+
+    calendar = Calendar(version, entries, occurrences)
+    _calendar = calendar
+    _checked_at = time.monotonic()
+    _stale = False
+    return calendar
+
+
+async def get_calendar() -> Calendar:
+    """
+    Возвращает текущий снимок. Версия в БД сверяется не чаще, чем раз
+    в CALENDAR_CHECK_INTERVAL секунд, всё остальное время — без запросов.
+    """
+    global _checked_at
+    calendar = _calendar
+    if calendar is not None and not _stale and time.monotonic() - _checked_at < CALENDAR_CHECK_INTERVAL:
+        return calendar
+
+    async with _lock:
+        calendar = _calendar
+        if calendar is None or _stale:
+            return await load_calendar()
+        if time.monotonic() - _checked_at < CALENDAR_CHECK_INTERVAL:
+            return calendar
+
+        async with read_session() as session:
+            version = await _read_version(session)
+        if version != calendar.version:
+            return await load_calendar()
+        _checked_at = time.monotonic()
+        return calendar
+
+
+def invalidate_calendar():
+    """Помечает снимок устаревшим в текущем процессе."""
+    global _stale
+    _stale = True
+
+
+async def bump_calendar_version(session):
+    """
+    Увеличивает версию календаря в БД, чтобы все процессы перечитали его.
+    Вызывать в той же транзакции, что и изменение праздников; commit — на вызывающем.
+    """
+    res = await session.execute(
+        update(CalendarVersion).where(CalendarVersion.id == 1).values(version=CalendarVersion.version + 1)
+    )
+    if res.rowcount == 0:
+        await session.execute(insert(CalendarVersion).values(id=1, version=1))
+    invalidate_calendar()
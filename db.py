@@ -1,15 +1,92 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-import os
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import os, time
 from dotenv import load_dotenv
-from models import Base
+from metrics import instrument_engine, registry
 
 load_dotenv()
 
 DB_DSN = os.getenv("DB_DSN")
-engine = create_async_engine(DB_DSN, echo=False, future=True)
+# реплика для чтения; пусто — все запросы идут в DB_DSN
+DB_READ_DSN = os.getenv("DB_READ_DSN", "")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0") == "1"
+# кэш скомпилированных SQLAlchemy-запросов и кэш prepared statements asyncpg (на соединение)
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", 500))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+pool_wait_seconds = registry.histogram(
+    "db_pool_wait_seconds", "Ожидание соединения из пула", ("engine",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+pool_checkouts = registry.counter(
+    "db_pool_checkouts_total", "Выдано соединений из пула", ("engine",))
+
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    """Очередь соединений, которая считает выдачи и время ожидания свободного соединения."""
+
+    engine_name = ""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - started, engine=self.engine_name)
+            pool_checkouts.inc(engine=self.engine_name)
+
+
+def _create_engine(dsn: str, name: str):
+    url = make_url(dsn)
+    kwargs = {"echo": False, "future": True, "query_cache_size": DB_QUERY_CACHE_SIZE}
+    if url.get_backend_name() == "postgresql" and url.get_driver_name() == "asyncpg":
+        kwargs["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    # SQLite в памяти живёт в одном соединении — пул ему не настраиваем
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        pool_class = type(f"TimedQueuePool_{name}", (_TimedQueuePool,), {"engine_name": name})
+        kwargs.update(
+            poolclass=pool_class,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    engine = create_async_engine(dsn, **kwargs)
+    # время и число SQL-запросов — в metrics
+    instrument_engine(engine)
+    pool = engine.sync_engine.pool
+    if hasattr(pool, "checkedout"):
+        registry.register_stats(f"db_pool_{name}", lambda: {
+            "size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow(),
+        })
+    return engine
+
+
+engine = _create_engine(DB_DSN, "write")
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Только чтение, где отставание реплики допустимо: снимок календаря, список поясов.
+# Без DB_READ_DSN это тот же движок и тот же пул.
+read_engine = _create_engine(DB_READ_DSN, "read") if DB_READ_DSN else engine
+read_session = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def dispose_engines():
+    # для скриптов: без этого потоки aiosqlite не дают процессу завершиться
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+    # migrations импортирует db, поэтому импорт здесь, а не в начале модуля
+    from migrations import upgrade
+
+    # таблицы по моделям, а для уже существующих баз — индексы и изменения схемы
+    await upgrade()
@@ -0,0 +1,396 @@
+"""
+Потоковый импорт праздников из CSV, JSON lines и iCalendar (.ics).
+
+    python holiday_import.py holidays.csv --scope kz
+    python holiday_import.py calendar.ics --scope ru --lang ru --dry-run
+
+Файл читается построчно и пишется пачками по IMPORT_BATCH_SIZE записей: на пачку — один
+SELECT существующих праздников с переводами, один INSERT ... ON CONFLICT (scope, month, day, rule)
+и один INSERT ... ON CONFLICT (holiday_id, lang). Праздник определяется ключом
+(scope, month, day, rule); записи с одним ключом сливаются, переводы дополняются и заменяются.
+Даты новых праздников сразу разворачиваются в holiday_occurrences.
+Некорректные записи пропускаются с номером строки. С --dry-run база не меняется,
+печатается только разница.
+
+Переходящие праздники задаются правилом (recurrence.py): для nth нужен только месяц,
+для easter, hijri и dates month и day не указываются.
+
+CSV: колонки month, day, необязательные scope, type и rule, остальные — коды языков (ru, kk, en...).
+JSON lines: {"month": 12, "day": 16, "scope": "kz", "translations": {"ru": "...", "kk": "..."}},
+для переходящих — {"rule": "easter:orthodox", "translations": {...}}.
+iCalendar: VEVENT с DTSTART (берутся месяц и день) и SUMMARY, язык — из параметра
+LANGUAGE или --lang.
+"""
+import argparse, asyncio, csv, json, os, re, sys
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, update, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from db import async_session
+from models import Holiday, HolidayTranslation
+from calendar_cache import bump_calendar_version
+from holiday_index import day_of_year
+from occurrences import refresh_occurrences
+from recurrence import parse_rule, RuleError
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+DEFAULT_SCOPE = "kz"
+REGULAR, BIRTHDAY = "regular", "birthday"
+
+_CSV_FIELDS = {"month", "day", "scope", "type", "rule"}
+_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".ics": "ics"}
+_ICS_ESCAPE = re.compile(r"\\([\\;,nN])")
+
+
+@dataclass
+class HolidayRecord:
+    month: int
+    day: int
+    names: dict  # язык -> название
+    scope: str = DEFAULT_SCOPE
+    type: str = REGULAR
+    line: int = 0
+    rule: str = ""
+
+    @property
+    def key(self) -> tuple:
+        return self.scope, self.month, self.day, self.rule
+
+
+class RecordError(ValueError):
+    """Некорректная запись; line — номер строки файла (для .ics — начала события)."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"строка {line}: {message}")
+        self.line = line
+
+
+def build_record(month, day, names: dict, scope: str = DEFAULT_SCOPE, type: str = REGULAR,
+                 line: int = 0, rule: str = "") -> HolidayRecord:
+    """Проверяет и нормализует запись; RecordError, если дата, правило или названия некорректны."""
+    type = type or REGULAR
+    rule = (rule or "").strip().lower()
+    if type == BIRTHDAY:
+        # «праздник» дня рождения один, его дата не используется
+        month, day, rule = 0, 0, ""
+    elif type != REGULAR:
+        raise RecordError(line, f"неизвестный тип {type!r}")
+    else:
+        try:
+            parsed = parse_rule(rule)
+        except RuleError as e:
+            raise RecordError(line, str(e)) from None
+        if rule == "fixed":
+            rule = ""
+        try:
+            # у переходящих праздников месяц и день (кроме месяца для nth) не используются
+            month = int(month) if parsed.uses_month else 0
+            day = int(day) if parsed.uses_day else 0
+            if parsed.uses_day:
+                day_of_year(month, day)
+            elif parsed.uses_month and not 1 <= month <= 12:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise RecordError(line, f"нет такой даты: месяц {month!r}, день {day!r}") from None
+
+    names = {
+        str(lang).strip().lower(): name.strip()
+        for lang, name in names.items()
+        if isinstance(name, str) and name.strip()
+    }
+    if not names:
+        raise RecordError(line, "нет ни одного названия")
+    for lang in names:
+        if not 2 <= len(lang) <= 5:
+            raise RecordError(line, f"некорректный код языка {lang!r}")
+    return HolidayRecord(month, day, names, scope or DEFAULT_SCOPE, type, line, rule)
+
+
+def read_csv(lines, scope: str = DEFAULT_SCOPE):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        try:
+            names = {key: value for key, value in row.items() if key and key not in _CSV_FIELDS}
+            yield build_record(row.get("month"), row.get("day"), names,
+                               row.get("scope") or scope, row.get("type"), reader.line_num, row.get("rule"))
+        except RecordError as e:
+            yield e
+
+
+def read_jsonl(lines, scope: str = DEFAULT_SCOPE):
+    for number, text in enumerate(lines, 1):
+        if not text.strip():
+            continue
+        try:
+            item = json.loads(text)
+            if not isinstance(item, dict):
+                raise RecordError(number, "ожидается JSON-объект")
+            names = item.get("translations")
+            if not isinstance(names, dict):
+                raise RecordError(number, "translations должен быть объектом {язык: название}")
+            yield build_record(item.get("month"), item.get("day"), names,
+                               item.get("scope") or scope, item.get("type"), number, item.get("rule"))
+        except json.JSONDecodeError as e:
+            yield RecordError(number, f"некорректный JSON: {e.msg}")
+        except RecordError as e:
+            yield e
+
+
+def _unfold(lines):
+    """Склеивает перенесённые строки iCalendar (продолжение начинается с пробела или табуляции)."""
+    current, start = None, 0
+    for number, text in enumerate(lines, 1):
+        text = text.rstrip("\r\n")
+        if text[:1] in (" ", "\t") and current is not None:
+            current += text[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = text, number
+    if current is not None:
+        yield start, current
+
+
+def _ics_unescape(value: str) -> str:
+    return _ICS_ESCAPE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def read_ics(lines, scope: str = DEFAULT_SCOPE, lang: str = "ru"):
+    """События VEVENT как ежегодные праздники: из DTSTART берутся только месяц и день."""
+    event = None
+    for number, text in _unfold(lines):
+        name, _, value = text.partition(":")
+        prop, *params = name.split(";")
+        prop = prop.upper()
+        if prop == "BEGIN" and value.strip().upper() == "VEVENT":
+            event = {"line": number, "start": None, "names": {}}
+        elif event is None:
+            continue
+        elif prop == "DTSTART":
+            event["start"] = value.strip()
+        elif prop == "SUMMARY":
+            params = dict(p.split("=", 1) for p in params if "=" in p)
+            params = {key.upper(): val for key, val in params.items()}
+            event_lang = params.get("LANGUAGE", lang).split("-")[0].lower()
+            event["names"][event_lang] = _ics_unescape(value)
+        elif prop == "END" and value.strip().upper() == "VEVENT":
+            start, line = event["start"] or "", event["line"]
+            try:
+                if len(start) < 8 or not start[:8].isdigit():
+                    raise RecordError(line, f"нет даты в DTSTART: {start!r}")
+                yield build_record(start[4:6], start[6:8], event["names"], scope, REGULAR, line)
+            except RecordError as e:
+                yield e
+            event = None
+
+
+def read_records(path: str, fmt: str = None, scope: str = DEFAULT_SCOPE, lang: str = "ru"):
+    """Записи файла по одной (или RecordError вместо некорректной) — без чтения файла целиком."""
+    fmt = fmt or _FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"не удалось определить формат {path}; укажите --format")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            yield from read_csv(f, scope)
+        elif fmt == "jsonl":
+            yield from read_jsonl(f, scope)
+        elif fmt == "ics":
+            yield from read_ics(f, scope, lang)
+        else:
+            raise ValueError(f"неизвестный формат {fmt}")
+
+
+def _batches(records, size: int, stats: dict, report):
+    """Пачки {ключ: запись}; записи с одинаковым ключом сливаются, ошибки считаются и печатаются."""
+    batch = {}
+    for record in records:
+        if isinstance(record, RecordError):
+            stats["invalid"] += 1
+            report(f"✗ {record}")
+            continue
+        stats["read"] += 1
+        seen = batch.get(record.key)
+        if seen is not None:
+            record.names = {**seen.names, **record.names}
+        batch[record.key] = record
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def _label(record: HolidayRecord) -> str:
+    label = f"{record.scope} {record.month:02d}-{record.day:02d}"
+    return f"{label} [{record.rule}]" if record.rule else label
+
+
+async def _load_existing(session, keys) -> dict:
+    """Ключ -> [id, type, {язык: название}] для уже существующих праздников пачки."""
+    res = await session.execute(
+        select(Holiday.id, Holiday.scope, Holiday.month, Holiday.day, Holiday.rule, Holiday.type,
+               HolidayTranslation.lang, HolidayTranslation.name)
+        .outerjoin(HolidayTranslation, HolidayTranslation.holiday_id == Holiday.id)
+        .where(tuple_(Holiday.scope, Holiday.month, Holiday.day, Holiday.rule).in_(keys))
+    )
+    existing = {}
+    for holiday_id, scope, month, day, rule, type, lang, name in res.all():
+        entry = existing.setdefault((scope, month, day, rule), [holiday_id, type, {}])
+        if lang is not None:
+            entry[2][lang] = name
+    return existing
+
+
+def _dialect_insert(session, model):
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    return None
+
+
+async def _upsert_holidays(session, rows) -> dict:
+    dialect_insert = _dialect_insert(session, Holiday)
+    if dialect_insert is not None:
+        stmt = dialect_insert.values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Holiday.scope, Holiday.month, Holiday.day, Holiday.rule],
+            set_={"type": stmt.excluded.type},
+        ).returning(Holiday.id, Holiday.scope, Holiday.month, Holiday.day, Holiday.rule)
+        res = await session.execute(stmt)
+        return {(scope, month, day, rule): holiday_id for holiday_id, scope, month, day, rule in res.all()}
+
+    ids = {}
+    for row in rows:
+        key = (row["scope"], row["month"], row["day"], row["rule"])
+        res = await session.execute(
+            update(Holiday)
+            .where(Holiday.scope == row["scope"], Holiday.month == row["month"], Holiday.day == row["day"],
+                   Holiday.rule == row["rule"])
+            .values(type=row["type"])
+            .returning(Holiday.id)
+        )
+        holiday_id = res.scalar()
+        if holiday_id is None:
+            holiday_id = (await session.execute(insert(Holiday).values(row).returning(Holiday.id))).scalar_one()
+        ids[key] = holiday_id
+    return ids
+
+
+async def _upsert_translations(session, rows):
+    dialect_insert = _dialect_insert(session, HolidayTranslation)
+    if dialect_insert is not None:
+        stmt = dialect_insert.values(rows)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[HolidayTranslation.holiday_id, HolidayTranslation.lang],
+            set_={"name": stmt.excluded.name},
+        ))
+        return
+    for row in rows:
+        res = await session.execute(
+            update(HolidayTranslation)
+            .where(HolidayTranslation.holiday_id == row["holiday_id"], HolidayTranslation.lang == row["lang"])
+            .values(name=row["name"])
+        )
+        if not res.rowcount:
+            await session.execute(insert(HolidayTranslation).values(row))
+
+
+async def _import_batch(session, batch: dict, stats: dict, dry_run: bool, report):
+    existing = await _load_existing(session, list(batch))
+    holiday_rows = []
+    changes = {}
+    for key, record in batch.items():
+        current = existing.get(key)
+        if current is None:
+            stats["created"] += 1
+            holiday_rows.append({"scope": record.scope, "month": record.month, "day": record.day,
+                                 "rule": record.rule, "type": record.type})
+            changes[key] = record.names
+            if dry_run:
+                names = ", ".join(f"{lang}={name}" for lang, name in record.names.items())
+                report(f"+ {_label(record)} {record.type}: {names}")
+            continue
+
+        _, current_type, current_names = current
+        changed = {lang: name for lang, name in record.names.items() if current_names.get(lang) != name}
+        if current_type != record.type:
+            holiday_rows.append({"scope": record.scope, "month": record.month, "day": record.day,
+                                 "rule": record.rule, "type": record.type})
+        if not changed and current_type == record.type:
+            stats["unchanged"] += 1
+            continue
+        stats["updated"] += 1
+        changes[key] = changed
+        if dry_run:
+            if current_type != record.type:
+                report(f"~ {_label(record)} type: {current_type} → {record.type}")
+            for lang, name in changed.items():
+                report(f"~ {_label(record)} {lang}: {current_names.get(lang)!r} → {name!r}")
+
+    if dry_run:
+        return
+    ids = {key: current[0] for key, current in existing.items()}
+    if holiday_rows:
+        ids.update(await _upsert_holidays(session, holiday_rows))
+        # новые праздники и сменившие тип: их даты появляются в holiday_occurrences (или уходят)
+        keys = [(row["scope"], row["month"], row["day"], row["rule"]) for row in holiday_rows]
+        stats["occurrences"] += await refresh_occurrences(session, [ids[key] for key in keys])
+    translation_rows = [
+        {"holiday_id": ids[key], "lang": lang, "name": name}
+        for key, names in changes.items()
+        for lang, name in names.items()
+    ]
+    if translation_rows:
+        await _upsert_translations(session, translation_rows)
+    stats["translations"] += len(translation_rows)
+
+
+async def import_records(records, dry_run: bool = False, batch_size: int = IMPORT_BATCH_SIZE,
+                         report=print) -> dict:
+    """
+    Импортирует записи (HolidayRecord или RecordError) одной транзакцией и один раз
+    поднимает версию календаря. Возвращает счётчики read/invalid/created/updated/unchanged/translations
+    и число изменённых строк holiday_occurrences.
+    """
+    stats = dict.fromkeys(("read", "invalid", "created", "updated", "unchanged", "translations", "occurrences"), 0)
+    async with async_session() as session:
+        for batch in _batches(records, batch_size, stats, report):
+            await _import_batch(session, batch, stats, dry_run, report)
+        if dry_run or not (stats["created"] or stats["updated"]):
+            await session.rollback()
+        else:
+            # сообщаем запущенным ботам, что календарь изменился
+            await bump_calendar_version(session)
+            await session.commit()
+    return stats
+
+
+async def main(argv) -> int:
+    from db import init_db, dispose_engines
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(set(_FORMATS.values())), help="по умолчанию — по расширению")
+    parser.add_argument("--scope", default=DEFAULT_SCOPE, help="scope для записей, где он не указан")
+    parser.add_argument("--lang", default="ru", help="язык SUMMARY без параметра LANGUAGE (.ics)")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="только показать разницу")
+    args = parser.parse_args(argv)
+
+    try:
+        await init_db()
+        records = read_records(args.path, args.format, args.scope, args.lang)
+        stats = await import_records(records, args.dry_run, args.batch_size)
+    finally:
+        await dispose_engines()
+    prefix = "dry run, база не изменена: " if args.dry_run else ""
+    print(prefix + ", ".join(f"{key}={value}" for key, value in stats.items()))
+    return 1 if stats["invalid"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
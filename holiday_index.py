@@ -0,0 +1,58 @@
+from bisect import bisect_left
+from datetime import date
+from itertools import islice
+
+# Високосный год-опора: в нём есть все возможные (month, day), включая 29 февраля
+_BASE = date(2000, 1, 1)
+
+
+def day_of_year(month: int, day: int) -> int:
+    """Номер дня (0..365) в високосном году; ValueError для несуществующей даты."""
+    return (date(_BASE.year, month, day) - _BASE).days
+
+
+class HolidayIndex:
+    """
+    Отсортированный по дате индекс вхождений праздников (из holiday_occurrences).
+    Запросы — bisect по датам и проход только по нужным записям; дальше
+    материализованного окна индекс не заглядывает.
+    """
+    __slots__ = ("_dates", "_items")
+
+    def __init__(self, occurrences):
+        """occurrences — пары (date, holiday)."""
+        items = sorted(occurrences, key=lambda x: (x[0], x[1].id))
+        self._dates = tuple(d for d, _ in items)
+        self._items = tuple(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        """Пары (date, holiday) в порядке дат."""
+        return iter(self._items)
+
+    def iter_from(self, start: date):
+        """Поток (holiday, date) начиная с даты start включительно."""
+        for i in range(bisect_left(self._dates, start), len(self._items)):
+            h_date, h = self._items[i]
+            yield h, h_date
+
+    def next_on_or_after(self, start: date):
+        """Ближайший праздник начиная с start, либо None."""
+        return next(self.iter_from(start), None)
+
+    def next_n(self, start: date, n: int) -> list:
+        """n ближайших праздников (меньше, если окно заканчивается раньше)."""
+        return list(islice(self.iter_from(start), max(0, n)))
+
+    def between(self, start: date, end: date) -> list:
+        """Праздники в диапазоне [start, end] включительно."""
+        result = []
+        if end < start:
+            return result
+        for h, h_date in self.iter_from(start):
+            if h_date > end:
+                break
+            result.append((h, h_date))
+        return result
@@ -0,0 +1,230 @@
+import json, os
+from string import Formatter
+from types import MappingProxyType
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_LANG = "ru"
+# каталог с файлами <lang>.json ({"ключ": "текст" | ["форма", ...]}); пусто — только MESSAGES
+LOCALES_DIR = os.getenv("LOCALES_DIR", "")
+
+# Встроенные тексты; файлы из LOCALES_DIR дополняют и переопределяют их
+MESSAGES = {
+    "start": {
+        "ru": "Привет! ✅ Ты зарегистрирован.",
+        "kk": "Сәлем! ✅ Сен тіркелдің.",
+        "en": "Hello! ✅ You are registered."
+    },
+    "help": {
+        "ru": "ℹ️ Команды:\n/next_holidays [N] — N ближайших праздников (по умолчанию 3)\n/month_holidays — праздники до конца месяца\n/holidays — ближайший праздник\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_tz Asia/Almaty\n/scopes — календари праздников\n/set_lang ru|kk|en",
+        "kk": "ℹ️ Командалар:\n/next_holidays [N] — N жақын мереке (әдепкі 3)\n/month_holidays — ай соңына дейінгі мерекелер\n/holidays — жақын мереке\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_tz Asia/Almaty\n/scopes — мерекелер күнтізбелері\n/set_lang ru|kk|en",
+        "en": "ℹ️ Commands:\n/next_holidays [N] — N upcoming holidays (3 by default)\n/month_holidays — holidays until the end of the month\n/holidays — next holiday\n/set_birthday DD-MM[(-YYYY)]\n/my_birthday\n/clear_birthday\n/set_tz Asia/Almaty\n/scopes — holiday calendars\n/set_lang ru|kk|en"
+    },
+    "tz_saved": {
+        "ru": "🕘 Часовой пояс сохранён: {tz}",
+        "kk": "🕘 Уақыт белдеуі сақталды: {tz}",
+        "en": "🕘 Time zone saved: {tz}"
+    },
+    "tz_invalid": {
+        "ru": "⚠️ Неизвестный часовой пояс. Пример: /set_tz Asia/Almaty",
+        "kk": "⚠️ Белгісіз уақыт белдеуі. Мысал: /set_tz Asia/Almaty",
+        "en": "⚠️ Unknown time zone. Example: /set_tz Asia/Almaty"
+    },
+    "scopes_title": {
+        "ru": "🗓 Твои календари праздников: {scopes}\nНажми на календарь, чтобы подписаться или отписаться.",
+        "kk": "🗓 Сенің мерекелер күнтізбелерің: {scopes}\nЖазылу немесе бас тарту үшін күнтізбені бас.",
+        "en": "🗓 Your holiday calendars: {scopes}\nTap a calendar to subscribe or unsubscribe."
+    },
+    "scopes_none": {"ru": "нет", "kk": "жоқ", "en": "none"},
+    "scope_on": {
+        "ru": "✅ Подписка на {scope} оформлена", "kk": "✅ {scope} күнтізбесіне жазылдың",
+        "en": "✅ Subscribed to {scope}"},
+    "scope_off": {
+        "ru": "Подписка на {scope} отменена", "kk": "{scope} күнтізбесінен бас тарттың",
+        "en": "Unsubscribed from {scope}"},
+    "lang_saved": {
+        "ru": "✅ Язык сохранён: {lang}",
+        "kk": "✅ Тіл сақталды: {lang}",
+        "en": "✅ Language saved: {lang}"
+    },
+
+    # ДР
+    "birthday_saved": {
+        "ru": "🎂 Дата рождения сохранена: {date}",
+        "kk": "🎂 Туған күн сақталды: {date}",
+        "en": "🎂 Birthday saved: {date}"
+    },
+    "birthday_show": {
+        "ru": "📅 Твоя дата рождения: {date}",
+        "kk": "📅 Сенің туған күнің: {date}",
+        "en": "📅 Your birthday: {date}"
+    },
+    "birthday_cleared": {
+        "ru": "❌ Дата рождения удалена",
+        "kk": "❌ Туған күн өшірілді",
+        "en": "❌ Birthday cleared"
+    },
+    "birthday_not_set": {
+        "ru": "⚠️ Дата рождения не установлена",
+        "kk": "⚠️ Туған күн орнатылмаған",
+        "en": "⚠️ Birthday not set"
+    },
+
+    #next holidays
+    "holiday_today": {"ru": "🎉 Сегодня праздник: {name}!",
+                      "kk": "🎉 Бүгін мереке: {name}!",
+                      "en": "🎉 Today is holiday: {name}!"},
+    "holiday_tomorrow": {"ru": "🎊 Завтра праздник: {name}!",
+                         "kk": "🎊 Ертең мереке: {name}!",
+                         "en": "🎊 Tomorrow is holiday: {name}!"},
+    # формы слова по правилам множественного числа языка (см. PLURAL_RULES)
+    "days_word": {"ru": ("день", "дня", "дней"),
+                  "kk": ("күн",),
+                  "en": ("day", "days")},
+    "holiday_future": {"ru": "⏳ До праздника «{name}» осталось {delta} {days_word}\n📅 {date}",
+                       "kk": "⏳ «{name}» мерекесіне дейін {delta} {days_word} қалды\n📅 {date}",
+                       "en": "⏳ {delta} {days_word} left until «{name}»\n📅 {date}"},
+    "next_holidays_header": {"ru": "📅 Ближайшие праздники:",
+                             "kk": "📅 Жақын мерекелер:",
+                             "en": "📅 Upcoming holidays:"},
+    "no_holidays": {"ru": "⚠️ Нет ближайших праздников",
+                    "kk": "⚠️ Жақын мерекелер жоқ",
+                    "en": "⚠️ No upcoming holidays"},
+    "month_holidays_header": {"ru": "📅 Праздники в этом месяце:",
+                              "kk": "📅 Осы айдағы мерекелер:",
+                              "en": "📅 Holidays this month:"},
+    "no_holidays_month": {"ru": "⚠️ До конца месяца праздников нет",
+                          "kk": "⚠️ Ай соңына дейін мерекелер жоқ",
+                          "en": "⚠️ No more holidays this month"},
+
+    # Кнопки главного меню
+    "btn_holidays": {"ru": "📅 Праздники", "kk": "📅 Мерекелер", "en": "📅 Holidays"},
+    "btn_next3": {"ru": "🗓️ 3 ближайших", "kk": "🗓️ 3 жақын", "en": "🗓️ Next 3"},
+    "btn_next10": {"ru": "🗓️ 10 ближайших", "kk": "🗓️ 10 жақын", "en": "🗓️ Next 10"},
+    "btn_month": {"ru": "📆 В этом месяце", "kk": "📆 Осы айда", "en": "📆 This month"},
+    "btn_lang": {"ru": "🌐 Язык", "kk": "🌐 Тіл", "en": "🌐 Language"},
+    "btn_birthday": {"ru": "🎂 Мой ДР", "kk": "🎂 Туған күнім", "en": "🎂 My bday"},
+
+    # Меню по ДР (inline)
+    "bday_menu_title": {"ru": "Управление ДР:", "kk": "Туған күн басқару:", "en": "Birthday menu:"},
+    "btn_bday_set": {"ru": "Установить ДР", "kk": "Туған күн қою", "en": "Set birthday"},
+    "btn_bday_view": {"ru": "Показать ДР", "kk": "Туған күн көрсету", "en": "View birthday"},
+    "btn_bday_clear": {"ru": "Удалить ДР", "kk": "Жою", "en": "Clear birthday"},
+    "bday_set_instructions": {
+        "ru": "Чтобы установить ДР, используй команду: DD-MM или DD-MM-YYYY(год можно не указывать).",
+        "kk": "Туған күнді орнату үшін: DD-MM немесе DD-MM-YYYY (жылды көрсетпеуге болады).",
+        "en": "To set birthday: DD-MM or DD-MM-YYYY (year optional)."
+    },
+
+    # language chooser: название языка на нём самом и prompt
+    "language_name": {"ru": "Русский 🇷🇺", "kk": "Қазақша 🇰🇿", "en": "English 🇬🇧"},
+    "choose_language_prompt": {
+        "ru": "Выберите язык:", "kk": "Тілді таңдаңыз:", "en": "Choose language:"},
+    "birthday_notifications": {
+        "ru": "🎉 Сегодня у тебя день рождения! С днём рождения, {user.name}! 🥳\n",
+        "kk": "🎉 Бүгін сенің туған күнің! Құтты болсын, {user.name}! 🥳\n",
+        "en": "🎉 Today is your birthday! Happy birthday, {user.name}! 🥳"
+    },
+}
+
+
+def _plural_ru(n: int) -> int:
+    if n % 10 == 1 and n % 100 != 11:
+        return 0
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return 1
+    return 2
+
+
+# язык -> функция, выбирающая номер формы для числа n
+PLURAL_RULES = {
+    "ru": _plural_ru,
+    "kk": lambda n: 0,
+    "en": lambda n: 0 if n == 1 else 1,
+}
+
+
+class Template:
+    """Текст, заранее разобранный на поля: без полей format не вызывается вовсе."""
+    __slots__ = ("text", "static")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.static = not any(field is not None for _, field, _, _ in Formatter().parse(text))
+
+    def render(self, kwargs: dict) -> str:
+        if self.static or not kwargs:
+            return self.text
+        try:
+            return self.text.format(**kwargs)
+        except Exception:
+            return self.text
+
+
+def _load_sources() -> dict:
+    sources = {key: dict(by_lang) for key, by_lang in MESSAGES.items()}
+    if LOCALES_DIR and os.path.isdir(LOCALES_DIR):
+        for filename in sorted(os.listdir(LOCALES_DIR)):
+            lang, ext = os.path.splitext(filename)
+            if ext != ".json":
+                continue
+            with open(os.path.join(LOCALES_DIR, filename), encoding="utf-8") as f:
+                for key, value in json.load(f).items():
+                    sources.setdefault(key, {})[lang] = tuple(value) if isinstance(value, list) else value
+    return sources
+
+
+def _compile(sources: dict):
+    languages = sorted({lang for by_lang in sources.values() for lang in by_lang})
+    templates, plurals = {}, {}
+    for key, by_lang in sources.items():
+        fallback = by_lang.get(DEFAULT_LANG) or next(iter(by_lang.values()), "")
+        for lang in languages:
+            # запасной вариант (DEFAULT_LANG, затем любой) выбираем один раз здесь
+            value = by_lang.get(lang) or fallback
+            if isinstance(value, tuple):
+                plurals[key, lang] = (value, PLURAL_RULES.get(lang if lang in by_lang else DEFAULT_LANG, PLURAL_RULES["en"]))
+            else:
+                templates[key, lang] = Template(value)
+    return tuple(languages), MappingProxyType(templates), MappingProxyType(plurals)
+
+
+LANGUAGES, _templates, _plurals = _compile(_load_sources())
+
+_EMPTY = Template("")
+
+
+def t(key, locale=DEFAULT_LANG, **kwargs):
+    template = _templates.get((key, locale)) or _templates.get((key, DEFAULT_LANG), _EMPTY)
+    return template.render(kwargs)
+
+
+def plural(key, n: int, locale=DEFAULT_LANG) -> str:
+    """Форма слова key для числа n по правилам языка."""
+    entry = _plurals.get((key, locale)) or _plurals.get((key, DEFAULT_LANG))
+    if entry is None:
+        return ""
+    forms, rule = entry
+    return forms[min(rule(n), len(forms) - 1)]
+
+
+def _button_index(actions: dict):
+    index = {}
+    for key, action in actions.items():
+        for lang in LANGUAGES:
+            index[t(key, lang)] = action
+    return MappingProxyType(index)
+
+
+# Кнопки главного меню (ключ текста -> действие) в порядке показа
+MENU_BUTTONS = {
+    "btn_holidays": "holidays",
+    "btn_next3": "next3",
+    "btn_next10": "next10",
+    "btn_month": "month",
+    "btn_lang": "lang_menu",
+    "btn_birthday": "bday_menu",
+}
+# текст кнопки на любом языке -> действие; собирается один раз
+BUTTON_ACTIONS = _button_index(MENU_BUTTONS)
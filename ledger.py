@@ -0,0 +1,136 @@
+import os, time
+from datetime import datetime
+import pytz
+from sqlalchemy import insert, update, delete, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from db import engine
+from models import Notification, NotificationArchive, OutboxMessage
+import outbox
+
+LEDGER_FLUSH_ROWS = int(os.getenv("LEDGER_FLUSH_ROWS", 500))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", 2))
+# COPY быстрее всего, но не умеет ON CONFLICT — включать, только если дубликатов быть не может
+LEDGER_USE_COPY = os.getenv("LEDGER_USE_COPY", "0") == "1"
+
+_NOTIFICATION_COLUMNS = ("user_id", "holiday_id", "year", "sent_at")
+
+# ключ advisory-блокировки PostgreSQL: чистку журнала выполняет один процесс из всех
+_PRUNE_LOCK_KEY = 0x48444E41
+
+
+def _insert_stmt(dialect_name: str, table=Notification.__table__):
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+async def write_notifications(conn, rows, use_copy: bool | None = None):
+    """
+    Пачкой пишет строки (user_id, holiday_id, year, sent_at) в notifications на соединении conn:
+    COPY через asyncpg на PostgreSQL (если разрешён), иначе executemany одним INSERT.
+    use_copy=None — по LEDGER_USE_COPY на момент вызова.
+    """
+    if not rows:
+        return
+    if use_copy is None:
+        use_copy = LEDGER_USE_COPY
+    if use_copy and conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Notification.__tablename__, records=rows, columns=_NOTIFICATION_COLUMNS
+        )
+        return
+    await conn.execute(
+        _insert_stmt(conn.dialect.name),
+        [dict(zip(_NOTIFICATION_COLUMNS, row)) for row in rows],
+    )
+
+
+class NotificationLedger:
+    """
+    Буфер успешных доставок. Строки notifications и отметки sent в outbox
+    пишутся одной транзакцией, когда набралось LEDGER_FLUSH_ROWS строк
+    или прошло LEDGER_FLUSH_INTERVAL секунд с прошлой записи.
+    use_copy — писать через COPY (None — по LEDGER_USE_COPY, см. write_notifications).
+    """
+
+    def __init__(self, flush_rows: int = LEDGER_FLUSH_ROWS, flush_interval: float = LEDGER_FLUSH_INTERVAL,
+                 use_copy: bool | None = None):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.use_copy = use_copy
+        self.rows_written = 0
+        self.flushes = 0
+        self._rows = []
+        self._outbox_ids = []
+        self._flushed_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, user_id: int, holiday_id: int, outbox_id: int | None = None, sent_at: datetime | None = None,
+            year: int | None = None):
+        # year — год поздравления (местного дня рассылки); по умолчанию год sent_at
+        sent_at = sent_at or datetime.now(pytz.utc)
+        self._rows.append((user_id, holiday_id, year or sent_at.year, sent_at))
+        if outbox_id is not None:
+            self._outbox_ids.append(outbox_id)
+
+    def due(self) -> bool:
+        if not self._rows:
+            return False
+        return len(self._rows) >= self.flush_rows or time.monotonic() - self._flushed_at >= self.flush_interval
+
+    async def maybe_flush(self):
+        if self.due():
+            await self.flush()
+
+    async def flush(self):
+        rows, ids = self._rows, self._outbox_ids
+        self._rows, self._outbox_ids = [], []
+        self._flushed_at = time.monotonic()
+        if not rows:
+            return
+
+        try:
+            async with engine.begin() as conn:
+                await write_notifications(conn, rows, self.use_copy)
+                if ids:
+                    await conn.execute(
+                        update(OutboxMessage)
+                        .where(OutboxMessage.id.in_(ids))
+                        .values(status=outbox.SENT, error=None, updated_at=datetime.now(pytz.utc))
+                    )
+        except Exception:
+            # вернём строки в буфер, чтобы следующая попытка их не потеряла
+            self._rows[:0] = rows
+            self._outbox_ids[:0] = ids
+            raise
+        self.rows_written += len(rows)
+        self.flushes += 1
+
+
+async def prune_notifications(session, before_year: int, archive: bool = False) -> int:
+    """
+    Удаляет из журнала строки за годы раньше before_year; с archive — сначала переносит
+    их в notifications_archive (в той же транзакции, уже перенесённые пропускаются).
+    Задача стоит в планировщике каждого процесса: на PostgreSQL чистку делает тот, кто
+    взял advisory-блокировку, остальные сразу возвращают 0. Коммит — за вызывающим.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        res = await session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _PRUNE_LOCK_KEY})
+        if not res.scalar_one():
+            return 0
+    old = Notification.year < before_year
+    if archive:
+        columns = ["user_id", "holiday_id", "year", "sent_at"]
+        await session.execute(
+            _insert_stmt(dialect, NotificationArchive.__table__).from_select(
+                columns, select(*(Notification.__table__.c[name] for name in columns)).where(old)
+            )
+        )
+    res = await session.execute(delete(Notification).where(old))
+    return res.rowcount
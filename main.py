@@ -1,10 +1,27 @@
-import asyncio
+import asyncio, os
 from scheduler import start_scheduler
 from bot import dp, bot
+from calendar_cache import load_calendar
+from db import init_db
+from webhook import run_webhook
+import metrics
+
+# 0 — рассылкой занимаются отдельные процессы worker.py
+RUN_SCHEDULER = os.getenv("RUN_SCHEDULER", "1") == "1"
+# polling — один процесс забирает апдейты сам; webhook — HTTP-сервер (см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
 async def main():
-    start_scheduler()
-    await dp.start_polling(bot)
+    await init_db()
+    # Календарь грузим один раз при старте, дальше его разделяют бот и планировщик
+    await load_calendar()
+    await metrics.start_server()
+    if RUN_SCHEDULER:
+        start_scheduler()
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,286 @@
+import os, time
+from aiohttp import web
+from aiogram import BaseMiddleware
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 0 — отдельный HTTP-сервер метрик не поднимается (в режиме webhook /metrics есть всегда)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+_DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_text(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels))
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_label_text(self.labelnames, key)} {value}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=_DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счётчики по корзинам..., сумма, количество]
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, border in enumerate(self.buckets):
+            if value <= border:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def get(self, **labels):
+        state = self._values.get(self._key(labels))
+        if state is None:
+            return None
+        return {"count": state[-1], "sum": state[-2], "buckets": dict(zip(self.buckets, state[:-2]))}
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, state in sorted(self._values.items()):
+            for border, count in zip(self.buckets, state):
+                le = 'le="%s"' % border
+                yield f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {count}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {state[-1]}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, key)} {state[-2]}"
+            yield f"{self.name}_count{_label_text(self.labelnames, key)} {state[-1]}"
+
+
+class Registry:
+    """
+    Метрики процесса. Снаружи читаются текстом в формате Prometheus (render) —
+    по HTTP или прямо из кода, например в тесте.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._sources = []
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=_DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def register_stats(self, prefix: str, stats, counters=()):
+        """
+        Источник, чьи значения читаются в момент выдачи: stats() -> dict.
+        Ключи из counters выдаются как счётчики (<prefix>_<key>_total), остальные — как gauge.
+        """
+        self._sources.append((prefix, stats, frozenset(counters)))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.lines())
+        for prefix, stats, counters in self._sources:
+            for key, value in stats().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in counters:
+                    name = f"{prefix}_{key}_total"
+                    lines += [f"# TYPE {name} counter", f"{name} {value}"]
+                else:
+                    name = f"{prefix}_{key}"
+                    lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram(
+    "bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Длительность SQL-запросов", ("statement",))
+fanout_planned = registry.counter(
+    "fanout_planned_total", "Строк outbox поставлено в очередь", ("holiday",))
+fanout_sent = registry.counter(
+    "fanout_sent_total", "Доставлено поздравлений", ("holiday",))
+fanout_failed = registry.counter(
+    "fanout_failed_total", "Поздравлений с ошибкой доставки", ("holiday", "kind"))
+outbox_pending = registry.gauge(
+    "outbox_pending", "Строк outbox, ждущих отправки (на момент последнего drain)")
+drain_skipped = registry.counter(
+    "outbox_drain_skipped_total", "Запуски drain, пропущенные из-за уже идущего drain")
+job_seconds = registry.histogram(
+    "scheduler_job_seconds", "Время выполнения задач планировщика", ("job",))
+job_errors = registry.counter(
+    "scheduler_job_errors_total", "Задачи планировщика, завершившиеся исключением", ("job",))
+job_overlaps = registry.counter(
+    "scheduler_job_overlaps_total", "Запуски, пропущенные из-за незавершённого предыдущего", ("job",))
+job_missed = registry.counter(
+    "scheduler_job_missed_total", "Запуски, пропущенные из-за опоздания (misfire)", ("job",))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware aiogram: время и ошибки по имени сработавшего хендлера."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, handler=name)
+
+
+def instrument_engine(engine):
+    """Время каждого SQL-запроса по событиям движка (для async-движка — его sync_engine)."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        db_query_seconds.observe(time.perf_counter() - started.pop(), statement=verb)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # после ошибки after_cursor_execute не вызывается — снимаем отметку сами
+        if context.connection is not None:
+            started = context.connection.info.get("query_started")
+            if started:
+                started.pop()
+
+
+def instrument_scheduler(scheduler):
+    """Слушатели APScheduler: время выполнения, ошибки, наложения и опоздания задач."""
+    from apscheduler.events import (
+        EVENT_JOB_ADDED, EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+        EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED,
+    )
+
+    running = {}
+    # id задачи -> имя функции, запомненное при добавлении: разовая задача (date) к моменту
+    # события уже снята, а её id (bucket:300) в метке дал бы по серии на каждое смещение
+    names = {}
+
+    def job_name(job_id):
+        if job_id in names:
+            return names[job_id]
+        job = scheduler.get_job(job_id)
+        return job.name if job is not None else job_id.split(":", 1)[0]
+
+    def listener(event):
+        if event.code == EVENT_JOB_ADDED:
+            job = scheduler.get_job(event.job_id)
+            if job is not None:
+                names[event.job_id] = job.name
+            return
+        name = job_name(event.job_id)
+        key = (event.job_id, event.scheduled_run_times[0] if hasattr(event, "scheduled_run_times")
+               else event.scheduled_run_time)
+        if event.code == EVENT_JOB_SUBMITTED:
+            running[key] = time.perf_counter()
+        elif event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+            started = running.pop(key, None)
+            if started is not None:
+                job_seconds.observe(time.perf_counter() - started, job=name)
+            if event.code == EVENT_JOB_ERROR:
+                job_errors.inc(job=name)
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            job_overlaps.inc(job=name)
+        elif event.code == EVENT_JOB_MISSED:
+            job_missed.inc(job=name)
+
+    scheduler.add_listener(
+        listener,
+        EVENT_JOB_ADDED | EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR
+        | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED,
+    )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Отдельный HTTP-сервер с /metrics; без порта ничего не делает."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics on {host}:{port}/metrics")
+    return runner
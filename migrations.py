@@ -0,0 +1,529 @@
+import asyncio, re, sys
+from sqlalchemy import (
+    Table, Column, Index, ForeignKey, Integer, SmallInteger, BigInteger, String, Date, TIMESTAMP,
+    MetaData, inspect, select, update, delete, extract, func, literal, text, and_, or_,
+)
+from sqlalchemy.schema import CreateColumn
+from db import engine
+from models import Base
+
+# Служебная таблица с номерами применённых миграций (отдельно от моделей)
+migration_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", TIMESTAMP(timezone=True), server_default=func.now()),
+)
+
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+# Миграции не смотрят в models.py: таблицы, колонки и индексы описаны в каждой миграции
+# так, как они выглядели в момент её выпуска. Применённую миграцию не правим — изменения
+# схемы идут только новыми миграциями.
+
+def _live_indexes(conn, table_name: str) -> dict:
+    """
+    Индексы таблицы прямо из каталога БД: имя -> уникальный ли.
+    Inspector пропускает индексы по выражениям (в SQLite), поэтому он тут не подходит.
+    """
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(
+            text("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :t"),
+            {"t": table_name},
+        )
+        return {name: definition.upper().startswith("CREATE UNIQUE") for name, definition in rows}
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"PRAGMA index_list('{table_name}')"))
+        return {row[1]: bool(row[2]) for row in rows}
+    return {i["name"]: bool(i.get("unique")) for i in inspect(conn).get_indexes(table_name)}
+
+
+def _index_names(conn, table_name: str) -> set:
+    return set(_live_indexes(conn, table_name))
+
+
+def _create_index(conn, index: Index):
+    if index.name not in _index_names(conn, index.table.name):
+        index.create(conn)
+
+
+def _add_column(conn, table_name: str, column: Column):
+    live = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column.name not in live:
+        Table(table_name, MetaData(), column)
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+
+
+def _rebuild_sqlite_table(conn, table: Table, indexes=()):
+    """
+    SQLite не умеет ALTER COLUMN: создаём таблицу заново по описанию миграции, копируем
+    строки и возвращаем индексы (DROP TABLE удаляет их вместе с таблицей).
+    Внешние ключи других таблиц ссылаются на имя, поэтому переживают пересоздание.
+    """
+    name = table.name
+    columns = ", ".join(c.name for c in table.columns)
+    # в том же MetaData: внешние ключи находят таблицы, на которые ссылаются
+    new = table.to_metadata(table.metadata, name=f"_new_{name}")
+    # индексы с теми же именами ещё живут на старой таблице — создаём их после переименования
+    new.indexes.clear()
+    new.create(conn)
+    conn.execute(text(f"INSERT INTO {new.name} ({columns}) SELECT {columns} FROM {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    conn.execute(text(f"ALTER TABLE {new.name} RENAME TO {name}"))
+    for index in indexes:
+        index.create(conn)
+
+
+@migration(1, "indexes for hot queries")
+def _m001_indexes(conn):
+    meta = MetaData()
+    users = Table("users", meta, Column("id", Integer), Column("tg_id", BigInteger), Column("birthday", Date))
+    notifications = Table("notifications", meta, Column("user_id", Integer), Column("holiday_id", Integer))
+    holidays = Table("holidays", meta, Column("month", Integer), Column("day", Integer))
+
+    # Уникальный индекс не создастся, пока в users есть дубликаты tg_id:
+    # оставляем самую раннюю запись каждого пользователя
+    keep = select(func.min(users.c.id)).group_by(users.c.tg_id)
+    duplicates = select(users.c.id).where(users.c.id.not_in(keep))
+    conn.execute(delete(notifications).where(notifications.c.user_id.in_(duplicates)))
+    conn.execute(delete(users).where(users.c.id.not_in(keep)))
+
+    _create_index(conn, Index("ix_users_tg_id", users.c.tg_id, unique=True))
+    _create_index(conn, Index(
+        "ix_users_birthday_md",
+        extract("month", users.c.birthday),
+        extract("day", users.c.birthday),
+        postgresql_where=users.c.birthday.isnot(None),
+        sqlite_where=users.c.birthday.isnot(None),
+    ))
+    _create_index(conn, Index("ix_notifications_holiday_user", notifications.c.holiday_id, notifications.c.user_id))
+    _create_index(conn, Index("ix_holidays_month_day", holidays.c.month, holidays.c.day))
+
+
+@migration(2, "birthday month/day columns")
+def _m002_birthday_parts(conn):
+    _add_column(conn, "users", Column("birthday_month", SmallInteger))
+    _add_column(conn, "users", Column("birthday_day", SmallInteger))
+    users = Table("users", MetaData(), Column("birthday", Date),
+                  Column("birthday_month", SmallInteger), Column("birthday_day", SmallInteger))
+    conn.execute(
+        update(users)
+        .where(users.c.birthday.isnot(None))
+        .values(
+            birthday_month=extract("month", users.c.birthday),
+            birthday_day=extract("day", users.c.birthday),
+        )
+    )
+    # индекс по выражениям из миграции 1 больше не нужен
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_birthday_md"))
+    _create_index(conn, Index(
+        "ix_users_birthday_month_day",
+        users.c.birthday_month,
+        users.c.birthday_day,
+        postgresql_where=users.c.birthday_month.isnot(None),
+        sqlite_where=users.c.birthday_month.isnot(None),
+    ))
+
+
+@migration(3, "outbox row leases")
+def _m003_outbox_leases(conn):
+    _add_column(conn, "notification_outbox", Column("lease_owner", String(64)))
+    _add_column(conn, "notification_outbox", Column("lease_until", TIMESTAMP(timezone=True)))
+
+
+@migration(4, "per-user time zone")
+def _m004_user_tz(conn):
+    _add_column(conn, "users", Column("tz", String(64)))
+    users = Table("users", MetaData(), Column("tz", String(64)))
+    _create_index(conn, Index("ix_users_tz", users.c.tz))
+
+
+@migration(5, "year-scoped notifications")
+def _m005_notification_year(conn):
+    _add_column(conn, "notifications", Column("year", SmallInteger))
+    meta = MetaData()
+    notifications = Table(
+        "notifications", meta,
+        Column("id", Integer), Column("user_id", Integer), Column("holiday_id", Integer),
+        Column("year", SmallInteger), Column("sent_at", TIMESTAMP(timezone=True)),
+    )
+    # для старых строк год берём из sent_at (UTC): на рубеже года он может разойтись
+    # с местным днём рассылки, но лишнее поздравление лучше пропущенного
+    conn.execute(
+        update(notifications)
+        .where(notifications.c.year.is_(None))
+        .values(year=func.coalesce(extract("year", notifications.c.sent_at),
+                                   extract("year", func.current_date())))
+    )
+    keep = (
+        select(func.min(notifications.c.id))
+        .group_by(notifications.c.holiday_id, notifications.c.year, notifications.c.user_id)
+    )
+    conn.execute(delete(notifications).where(notifications.c.id.not_in(keep)))
+    # индекс (holiday_id, user_id) из миграции 1 заменён уникальным с годом
+    conn.execute(text("DROP INDEX IF EXISTS ix_notifications_holiday_user"))
+    _create_index(conn, Index(
+        "ux_notifications_holiday_year_user",
+        notifications.c.holiday_id, notifications.c.year, notifications.c.user_id,
+        unique=True,
+    ))
+    archive = Table(
+        "notifications_archive", meta,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, nullable=False),
+        Column("holiday_id", Integer, nullable=False),
+        Column("year", SmallInteger, nullable=False),
+        Column("sent_at", TIMESTAMP(timezone=True)),
+    )
+    archive.create(conn, checkfirst=True)
+
+
+@migration(6, "unique holiday and translation keys")
+def _m006_holiday_keys(conn):
+    meta = MetaData()
+    holidays = Table("holidays", meta, Column("id", Integer), Column("day", Integer),
+                     Column("month", Integer), Column("scope", String))
+    translations = Table("holiday_translations", meta, Column("id", Integer), Column("holiday_id", Integer),
+                         Column("lang", String(5)))
+    dependents = [Table(name, meta, Column("holiday_id", Integer))
+                  for name in ("notifications", "notification_outbox")]
+    conn.execute(update(holidays).where(holidays.c.scope.is_(None)).values(scope="kz"))
+
+    # Импорт сопоставляет праздники по (scope, month, day): дубликаты сливаются в самый ранний.
+    # Переводы дубликата переходят к нему, если такого языка там ещё нет, остальное удаляется.
+    key = (holidays.c.scope, holidays.c.month, holidays.c.day)
+    groups = conn.execute(
+        select(*key, func.min(holidays.c.id)).group_by(*key).having(func.count() > 1)
+    ).all()
+    for scope, month, day, keeper in groups:
+        duplicates = select(holidays.c.id).where(
+            holidays.c.scope == scope, holidays.c.month == month, holidays.c.day == day,
+            holidays.c.id != keeper,
+        )
+        keeper_langs = select(translations.c.lang).where(translations.c.holiday_id == keeper)
+        conn.execute(
+            update(translations)
+            .where(translations.c.holiday_id.in_(duplicates), translations.c.lang.not_in(keeper_langs))
+            .values(holiday_id=keeper)
+        )
+        # SQLite без PRAGMA foreign_keys не выполняет ON DELETE CASCADE — чистим сами
+        for table in (translations, *dependents):
+            conn.execute(delete(table).where(table.c.holiday_id.in_(duplicates)))
+        conn.execute(delete(holidays).where(holidays.c.id.in_(duplicates)))
+        print(f"Праздники {scope} {month:02d}-{day:02d}: дубликаты слиты в {keeper}")
+
+    keep = select(func.min(translations.c.id)).group_by(translations.c.holiday_id, translations.c.lang)
+    conn.execute(delete(translations).where(translations.c.id.not_in(keep)))
+    _create_index(conn, Index("ux_holidays_scope_month_day",
+                              holidays.c.scope, holidays.c.month, holidays.c.day, unique=True))
+    _create_index(conn, Index("ux_holiday_translations_holiday_lang",
+                              translations.c.holiday_id, translations.c.lang, unique=True))
+
+
+@migration(7, "user scope subscriptions")
+def _m007_user_scopes(conn):
+    # users импортирует aiogram — только здесь, а не в начале модуля
+    from users import DEFAULT_SCOPES
+
+    meta = MetaData()
+    users = Table("users", meta, Column("id", Integer, primary_key=True))
+    scopes = Table(
+        "user_scopes", meta,
+        Column("scope", String(32), primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    )
+    scopes.create(conn, checkfirst=True)
+    _create_index(conn, Index("ix_user_scopes_user_id", scopes.c.user_id))
+    # до подписок всем приходили все праздники — подписываем существующих на календари по умолчанию
+    custom = select(scopes.c.user_id).where(
+        scopes.c.user_id == users.c.id, scopes.c.scope.not_in(DEFAULT_SCOPES)).exists()
+    for scope in DEFAULT_SCOPES:
+        present = select(scopes.c.user_id).where(scopes.c.user_id == users.c.id, scopes.c.scope == scope).exists()
+        conn.execute(scopes.insert().from_select(
+            ["scope", "user_id"],
+            select(literal(scope, String), users.c.id).where(~custom, ~present),
+        ))
+
+
+@migration(8, "holiday recurrence rules and occurrences")
+def _m008_holiday_occurrences(conn):
+    from occurrences import occurrence_window, expand
+
+    _add_column(conn, "holidays", Column("rule", String))
+    meta = MetaData()
+    holidays = Table("holidays", meta, Column("id", Integer, primary_key=True), Column("day", Integer),
+                     Column("month", Integer), Column("scope", String), Column("type", String),
+                     Column("rule", String))
+    occurrences = Table(
+        "holiday_occurrences", meta,
+        Column("date", Date, primary_key=True),
+        Column("holiday_id", Integer, ForeignKey("holidays.id", ondelete="CASCADE"), primary_key=True),
+    )
+    conn.execute(update(holidays).where(holidays.c.rule.is_(None)).values(rule=""))
+    # ключ (scope, month, day) из миграции 6 дополнен правилом: у переходящих праздников month/day = 0
+    conn.execute(text("DROP INDEX IF EXISTS ux_holidays_scope_month_day"))
+    _create_index(conn, Index("ux_holidays_scope_month_day_rule",
+                              holidays.c.scope, holidays.c.month, holidays.c.day, holidays.c.rule, unique=True))
+
+    occurrences.create(conn, checkfirst=True)
+    _create_index(conn, Index("ix_holiday_occurrences_holiday_id", occurrences.c.holiday_id))
+    if conn.execute(select(occurrences.c.holiday_id).limit(1)).first() is None:
+        rows = conn.execute(
+            select(holidays.c.id, holidays.c.month, holidays.c.day, holidays.c.rule)
+            .where(holidays.c.type.is_distinct_from("birthday"))
+        ).all()
+        wanted = expand(rows, *occurrence_window())
+        if wanted:
+            conn.execute(occurrences.insert(), [{"date": d, "holiday_id": h} for d, h in sorted(wanted)])
+
+
+@migration(9, "holiday rule not null")
+def _m009_holiday_rule_not_null(conn):
+    # миграция 8 добавила rule без NOT NULL и DEFAULT: строка с NULL обходила бы
+    # уникальный ключ (NULL ни с чем не конфликтует) и ON CONFLICT импорта
+    meta = MetaData()
+    holidays = Table(
+        "holidays", meta,
+        Column("id", Integer, primary_key=True),
+        Column("day", Integer, nullable=False),
+        Column("month", Integer, nullable=False),
+        Column("scope", String),
+        Column("type", String),
+        Column("rule", String, nullable=False, server_default=""),
+    )
+    conn.execute(update(holidays).where(holidays.c.rule.is_(None)).values(rule=""))
+    if conn.dialect.name == "sqlite":
+        _rebuild_sqlite_table(conn, holidays, [
+            Index("ix_holidays_month_day", holidays.c.month, holidays.c.day),
+            Index("ux_holidays_scope_month_day_rule",
+                  holidays.c.scope, holidays.c.month, holidays.c.day, holidays.c.rule, unique=True),
+        ])
+    else:
+        conn.execute(text("ALTER TABLE holidays ALTER COLUMN rule SET DEFAULT ''"))
+        conn.execute(text("ALTER TABLE holidays ALTER COLUMN rule SET NOT NULL"))
+
+
+@migration(10, "notification year not null")
+def _m010_notification_year_not_null(conn):
+    # миграция 5 добавила year без NOT NULL: строки с NULL не попадают под уникальный
+    # индекс (holiday_id, year, user_id), и журнал переставал бы отсекать повторы
+    meta = MetaData()
+    Table("users", meta, Column("id", Integer, primary_key=True))
+    Table("holidays", meta, Column("id", Integer, primary_key=True))
+    notifications = Table(
+        "notifications", meta,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+        Column("holiday_id", Integer, ForeignKey("holidays.id", ondelete="CASCADE")),
+        Column("year", SmallInteger, nullable=False),
+        Column("sent_at", TIMESTAMP(timezone=True), server_default=func.now()),
+    )
+
+    def year_of(t):
+        return func.coalesce(extract("year", t.c.sent_at), extract("year", func.current_date()))
+
+    # сначала убираем строки без года, которые после заполнения совпали бы с другими
+    other = notifications.alias("other")
+    duplicate = (
+        select(other.c.id)
+        .where(other.c.holiday_id == notifications.c.holiday_id,
+               other.c.user_id == notifications.c.user_id,
+               or_(other.c.year == year_of(notifications),
+                   and_(other.c.year.is_(None), other.c.id < notifications.c.id,
+                        year_of(other) == year_of(notifications))))
+        .exists()
+    )
+    conn.execute(delete(notifications).where(notifications.c.year.is_(None), duplicate))
+    conn.execute(
+        update(notifications)
+        .where(notifications.c.year.is_(None))
+        .values(year=year_of(notifications))
+    )
+    if conn.dialect.name == "sqlite":
+        _rebuild_sqlite_table(conn, notifications, [
+            Index("ux_notifications_holiday_year_user",
+                  notifications.c.holiday_id, notifications.c.year, notifications.c.user_id, unique=True),
+        ])
+    else:
+        conn.execute(text("ALTER TABLE notifications ALTER COLUMN year SET NOT NULL"))
+
+
+@migration(11, "user census change events")
+def _m011_user_census_changes(conn):
+    meta = MetaData()
+    changes = Table(
+        "user_census_changes", meta,
+        Column("id", Integer, primary_key=True),
+        Column("tz", String(64)),
+        Column("birthday_month", SmallInteger),
+        Column("birthday_day", SmallInteger),
+        Column("created_at", TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+    )
+    changes.create(conn, checkfirst=True)
+    _create_index(conn, Index("ix_user_census_changes_created_at", changes.c.created_at))
+
+
+@migration(12, "outbox retry backoff")
+def _m012_outbox_available_at(conn):
+    _add_column(conn, "notification_outbox", Column("available_at", TIMESTAMP(timezone=True)))
+
+
+@migration(13, "outbox send window")
+def _m013_outbox_expires_at(conn):
+    _add_column(conn, "notification_outbox", Column("expires_at", TIMESTAMP(timezone=True)))
+
+
+@migration(14, "unique notification archive rows")
+def _m014_archive_unique(conn):
+    meta = MetaData()
+    archive = Table(
+        "notifications_archive", meta,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, nullable=False),
+        Column("holiday_id", Integer, nullable=False),
+        Column("year", SmallInteger, nullable=False),
+        Column("sent_at", TIMESTAMP(timezone=True)),
+    )
+    # одновременный перенос в нескольких процессах мог задвоить строки архива
+    keep = (
+        select(func.min(archive.c.id))
+        .group_by(archive.c.holiday_id, archive.c.year, archive.c.user_id)
+    )
+    conn.execute(delete(archive).where(archive.c.id.not_in(keep)))
+    _create_index(conn, Index("ux_notifications_archive_holiday_year_user",
+                              archive.c.holiday_id, archive.c.year, archive.c.user_id, unique=True))
+
+
+def _applied_versions(conn) -> set:
+    schema_migrations.create(conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _apply(conn, version: int, name: str, fn):
+    fn(conn)
+    conn.execute(schema_migrations.insert().values(version=version, name=name))
+
+
+def _is_empty(conn) -> bool:
+    return not inspect(conn).get_table_names()
+
+
+def _stamp(conn):
+    conn.execute(schema_migrations.insert(), [{"version": version, "name": name} for version, name, _ in MIGRATIONS])
+
+
+async def upgrade():
+    """
+    Создаёт недостающие таблицы по моделям и применяет ещё не применённые миграции,
+    каждую в своей транзакции. Пустая база сразу получает текущую схему, и все миграции
+    отмечаются применёнными: старые миграции рассчитаны на схему своего времени.
+    """
+    async with engine.begin() as conn:
+        fresh = await conn.run_sync(_is_empty)
+        await conn.run_sync(Base.metadata.create_all)
+        applied = await conn.run_sync(_applied_versions)
+        if fresh:
+            await conn.run_sync(_stamp)
+            return
+
+    for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        async with engine.begin() as conn:
+            await conn.run_sync(_apply, version, name, fn)
+        print(f"Миграция {version} применена: {name}")
+
+
+def _normalize_default(value) -> str | None:
+    """DEFAULT из каталога или модели в сравнимом виде: без скобок, приведений типа и регистра."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    while value.startswith("(") and value.endswith(")"):
+        value = value[1:-1].strip()
+    return re.sub(r"::[\w ]+(\[\])?$", "", value).lower()
+
+
+def _model_default(conn, column) -> str | None:
+    if column.server_default is None:
+        return None
+    arg = column.server_default.arg
+    if isinstance(arg, str):
+        return _normalize_default("'" + arg.replace("'", "''") + "'")
+    return _normalize_default(arg.compile(dialect=conn.dialect))
+
+
+def _diff(conn) -> list:
+    insp = inspect(conn)
+    problems = []
+    live_tables = set(insp.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in live_tables:
+            problems.append(f"нет таблицы {table.name}")
+            continue
+        live_columns = {c["name"]: c for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            live = live_columns.get(column.name)
+            if live is None:
+                problems.append(f"нет колонки {table.name}.{column.name}")
+                continue
+            # первичный ключ NOT NULL в любом случае, SQLite не всегда это показывает
+            if not column.primary_key and live["nullable"] != column.nullable:
+                expected = "NULL" if column.nullable else "NOT NULL"
+                problems.append(f"колонка {table.name}.{column.name} должна быть {expected}")
+            expected, actual = _model_default(conn, column), _normalize_default(live.get("default"))
+            if expected != actual:
+                problems.append(f"у колонки {table.name}.{column.name} DEFAULT {actual} вместо {expected}")
+        live_indexes = _live_indexes(conn, table.name)
+        for index in table.indexes:
+            if index.name not in live_indexes:
+                problems.append(f"нет индекса {index.name} на {table.name}")
+            elif live_indexes[index.name] != bool(index.unique):
+                kind = "уникальным" if index.unique else "неуникальным"
+                problems.append(f"индекс {index.name} на {table.name} должен быть {kind}")
+
+    applied = set()
+    if schema_migrations.name in live_tables:
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+    for version, name, _ in MIGRATIONS:
+        if version not in applied:
+            problems.append(f"не применена миграция {version}: {name}")
+    return problems
+
+
+async def check() -> list:
+    """Сравнивает живую схему с моделями; возвращает список расхождений."""
+    async with engine.connect() as conn:
+        return await conn.run_sync(_diff)
+
+
+async def main(argv):
+    try:
+        if "--check" in argv:
+            problems = await check()
+            for p in problems:
+                print(f"✗ {p}")
+            if problems:
+                return 1
+            print("Схема совпадает с моделями.")
+            return 0
+        await upgrade()
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
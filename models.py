@@ -1,26 +1,50 @@
 from sqlalchemy.ext.asyncio import AsyncAttrs
-from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Date, BigInteger, ForeignKey, TIMESTAMP, func
+from sqlalchemy.orm import declarative_base, relationship, validates
+from sqlalchemy import Column, Integer, SmallInteger, String, Date, BigInteger, ForeignKey, TIMESTAMP, Index, func
 
 Base = declarative_base()
 
 
 class Holiday(AsyncAttrs, Base):
     __tablename__ = "holidays"
+    __table_args__ = (
+        Index("ix_holidays_month_day", "month", "day"),
+        # ключ импорта (holiday_import): один праздник на день и правило в каждом scope
+        Index("ux_holidays_scope_month_day_rule", "scope", "month", "day", "rule", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     day = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     scope = Column(String, default="kz")
     type = Column(String, default="regular") # regular/birthday
+    # правило повторения (recurrence.py); пусто — каждый год в month/day
+    rule = Column(String, nullable=False, default="", server_default="")
 
 
     translations = relationship("HolidayTranslation", back_populates="holiday", cascade="all, delete")
     notifications = relationship("Notification", back_populates="holiday")
 
 
+class HolidayOccurrence(Base):
+    """
+    Конкретные даты праздников, развёрнутые из правил на несколько лет вперёд (occurrences.py).
+    Первичный ключ начинается с даты: снимок календаря читает их одним диапазонным запросом.
+    """
+    __tablename__ = "holiday_occurrences"
+    __table_args__ = (
+        Index("ix_holiday_occurrences_holiday_id", "holiday_id"),
+    )
+
+    date = Column(Date, primary_key=True)
+    holiday_id = Column(Integer, ForeignKey("holidays.id", ondelete="CASCADE"), primary_key=True)
+
+
 class HolidayTranslation(AsyncAttrs, Base):
     __tablename__ = "holiday_translations"
+    __table_args__ = (
+        Index("ux_holiday_translations_holiday_lang", "holiday_id", "lang", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     holiday_id = Column(Integer, ForeignKey("holidays.id", ondelete="CASCADE"))
@@ -34,21 +58,129 @@ class User(AsyncAttrs, Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    tg_id = Column(BigInteger, nullable=False)
+    tg_id = Column(BigInteger, nullable=False, unique=True, index=True)
     name = Column(String, nullable=False)
     birthday = Column(Date, nullable=True)
+    # день и месяц ДР отдельно — для поиска именинников по индексу
+    birthday_month = Column(SmallInteger, nullable=True)
+    birthday_day = Column(SmallInteger, nullable=True)
     lang = Column(String(5), default="ru")
+    tz = Column(String(64), nullable=True, index=True)  # IANA-зона; NULL — TIMEZONE из настроек
 
     notifications = relationship("Notification", back_populates="user")
 
+    @validates("birthday")
+    def _sync_birthday_parts(self, key, value):
+        self.birthday_month = value.month if value else None
+        self.birthday_day = value.day if value else None
+        return value
+
+
+# поиск именинников по дню и месяцу без полного прохода по users
+Index(
+    "ix_users_birthday_month_day",
+    User.birthday_month,
+    User.birthday_day,
+    postgresql_where=User.birthday_month.isnot(None),
+    sqlite_where=User.birthday_month.isnot(None),
+)
+
+
+class CensusChange(Base):
+    """
+    Событие для переписи планировщика: пользователь ушёл из состояния (пояс, месяц и день ДР)
+    или пришёл в него. Пишется в той же транзакции, что и изменение users (users.upsert_user);
+    планировщик читает свежие события и пересчитывает только затронутые ключи.
+    """
+    __tablename__ = "user_census_changes"
+    __table_args__ = (
+        Index("ix_user_census_changes_created_at", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    tz = Column(String(64), nullable=True)
+    birthday_month = Column(SmallInteger, nullable=True)
+    birthday_day = Column(SmallInteger, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class UserScope(Base):
+    """
+    Подписка пользователя на календарь (страна, регион, религия, компания) — Holiday.scope.
+    Первичный ключ (scope, user_id) — готовая аудитория: рассылка праздника небольшого
+    календаря читает только его подписчиков, а не всю таблицу users.
+    """
+    __tablename__ = "user_scopes"
+    __table_args__ = (
+        Index("ix_user_scopes_user_id", "user_id"),
+    )
+
+    scope = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
 
 class Notification(AsyncAttrs, Base):
+    """Журнал доставок: не больше одного поздравления с праздником в год (по местному дню)."""
     __tablename__ = "notifications"
+    __table_args__ = (
+        # год стоит перед user_id: проверка «уже поздравляли» читает только срез текущего года
+        Index("ux_notifications_holiday_year_user", "holiday_id", "year", "user_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete='CASCADE'))
     holiday_id = Column(Integer, ForeignKey("holidays.id", ondelete='CASCADE'))
+    year = Column(SmallInteger, nullable=False)
     sent_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="notifications")
     holiday = relationship("Holiday", back_populates="notifications")
+
+
+class NotificationArchive(Base):
+    """Строки журнала за прошлые годы, перенесённые задачей хранения (без внешних ключей)."""
+    __tablename__ = "notifications_archive"
+    __table_args__ = (
+        # повторный перенос тех же строк (задача хранения в нескольких процессах) пропускается
+        Index("ux_notifications_archive_holiday_year_user", "holiday_id", "year", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    holiday_id = Column(Integer, nullable=False)
+    year = Column(SmallInteger, nullable=False)
+    sent_at = Column(TIMESTAMP(timezone=True))
+
+
+class OutboxMessage(AsyncAttrs, Base):
+    """Запланированная доставка (пользователь, праздник, язык) на конкретный день."""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ux_outbox_user_holiday_day", "user_id", "holiday_id", "day", unique=True),
+        Index("ix_outbox_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    holiday_id = Column(Integer, ForeignKey("holidays.id", ondelete="CASCADE"), nullable=False)
+    day = Column(Date, nullable=False)  # дата по TIMEZONE, на которую запланирована отправка
+    lang = Column(String(5), nullable=False)
+    status = Column(String(10), nullable=False, default="pending")  # pending/sending/sent/failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    # аренда строки воркером: после lease_until строку может забрать другой воркер
+    lease_owner = Column(String(64), nullable=True)
+    lease_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    # повтор после временной ошибки — не раньше этого момента; NULL — сразу
+    available_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # конец окна отправки (SEND_HOUR_END по местному времени дня day); позже строка не отправляется
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+
+class CalendarVersion(Base):
+    __tablename__ = "calendar_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,84 @@
+"""
+Материализация дат праздников: правила (recurrence.py) разворачиваются в строки
+holiday_occurrences на окно из прошлого года и OCCURRENCE_YEARS лет вперёд.
+Обновление инкрементальное: пересчитываются только нужные праздники, в БД
+уходят лишь недостающие и устаревшие строки.
+"""
+import os
+from datetime import date
+from sqlalchemy import select, insert, delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import Holiday, HolidayOccurrence
+from recurrence import parse_rule, dates_in_year, RuleError
+
+# На сколько лет вперёд (включая текущий) разворачиваются даты
+OCCURRENCE_YEARS = int(os.getenv("OCCURRENCE_YEARS", 3))
+
+
+def occurrence_window(today: date | None = None) -> tuple:
+    """[start, end] хранимых дат: прошлый год оставлен для поясов, где ещё вчера."""
+    year = (today or date.today()).year
+    return date(year - 1, 1, 1), date(year + OCCURRENCE_YEARS - 1, 12, 31)
+
+
+def _insert_ignore(session):
+    # обновление идёт в каждом процессе (бот, воркеры) — строку мог успеть вставить другой
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(HolidayOccurrence).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(HolidayOccurrence).on_conflict_do_nothing()
+    return insert(HolidayOccurrence)
+
+
+def expand(rows, start: date, end: date) -> set:
+    """
+    Пары (date, holiday_id) для строк (id, month, day, rule) в окне [start, end].
+    Праздник с некорректным правилом или датой пропускается с сообщением в журнал.
+    """
+    result = set()
+    for holiday_id, month, day, rule in rows:
+        try:
+            parsed = parse_rule(rule)
+            for year in range(start.year, end.year + 1):
+                for d in dates_in_year(parsed, month, day, year):
+                    if start <= d <= end:
+                        result.add((d, holiday_id))
+        except RuleError as e:
+            print(f"Праздник {holiday_id} пропущен: {e}")
+    return result
+
+
+async def refresh_occurrences(session, holiday_ids=None, today: date | None = None) -> int:
+    """
+    Приводит holiday_occurrences к правилам праздников holiday_ids (None — всех).
+    Возвращает число вставленных и удалённых строк; commit — на вызывающем.
+    """
+    start, end = occurrence_window(today)
+    holidays = select(Holiday.id, Holiday.month, Holiday.day, Holiday.rule).where(
+        Holiday.type.is_distinct_from("birthday"))
+    existing = select(HolidayOccurrence.date, HolidayOccurrence.holiday_id).where(
+        HolidayOccurrence.date.between(start, end))
+    if holiday_ids is not None:
+        holiday_ids = list(holiday_ids)
+        if not holiday_ids:
+            return 0
+        holidays = holidays.where(Holiday.id.in_(holiday_ids))
+        existing = existing.where(HolidayOccurrence.holiday_id.in_(holiday_ids))
+
+    wanted = expand((await session.execute(holidays)).all(), start, end)
+    present = set((await session.execute(existing)).all())
+    missing, stale = wanted - present, present - wanted
+
+    changed = 0
+    if holiday_ids is None:
+        # окно сдвинулось на новый год — прошедшие годы больше не нужны
+        res = await session.execute(delete(HolidayOccurrence).where(HolidayOccurrence.date < start))
+        changed += res.rowcount or 0
+    if stale:
+        await session.execute(delete(HolidayOccurrence).where(
+            tuple_(HolidayOccurrence.date, HolidayOccurrence.holiday_id).in_(sorted(stale))))
+    if missing:
+        await session.execute(_insert_ignore(session),
+                              [{"date": d, "holiday_id": h} for d, h in sorted(missing)])
+    return changed + len(stale) + len(missing)
@@ -0,0 +1,299 @@
+import calendar as calendar_module
+from datetime import date, datetime, timedelta
+import pytz
+from sqlalchemy import (
+    select, insert, update, delete, and_, or_, case, literal, func, text, Date, Integer, String, TIMESTAMP,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from models import User, UserScope, Notification, OutboxMessage
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+_COLUMNS = ["user_id", "holiday_id", "day", "lang", "status", "attempts", "available_at", "expires_at"]
+
+# ключ advisory-блокировки PostgreSQL, под которой воркеры по очереди планируют рассылку
+_PLAN_LOCK_KEY = 0x48444E50
+
+
+def _insert_ignore(session):
+    # Параллельный планировщик мог успеть вставить те же строки — их просто пропускаем
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(OutboxMessage).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(OutboxMessage).on_conflict_do_nothing()
+    return insert(OutboxMessage)
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    # SQLite возвращает время без пояса; пишем его в UTC
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=pytz.utc)
+    return value
+
+
+def _open(now: datetime):
+    """
+    Окно отправки строки ещё не закрылось. У строк без expires_at (поставленных до окон)
+    отсекается хотя бы прошедший день: местная дата любого пояса не раньше вчерашней по UTC.
+    """
+    return and_(
+        or_(OutboxMessage.expires_at.is_(None), OutboxMessage.expires_at > now),
+        OutboxMessage.day >= now.date() - timedelta(days=1),
+    )
+
+
+def _claimable(now: datetime):
+    """
+    Строки, окно отправки которых открыто: ожидающие (кроме отложенных до начала окна или
+    до повтора) и те, аренда которых истекла (воркер упал).
+    """
+    return and_(
+        _open(now),
+        or_(
+            and_(
+                OutboxMessage.status == PENDING,
+                or_(OutboxMessage.available_at.is_(None), OutboxMessage.available_at <= now),
+            ),
+            and_(
+                OutboxMessage.status == SENDING,
+                or_(OutboxMessage.lease_until.is_(None), OutboxMessage.lease_until < now),
+            ),
+        ),
+    )
+
+
+def birthday_dates(today: date) -> tuple:
+    """Пары (месяц, день) рождения, с которыми поздравляют в этот день."""
+    dates = ((today.month, today.day),)
+    # родившихся 29 февраля в невисокосный год поздравляем 28-го
+    if today.month == 2 and today.day == 28 and not calendar_module.isleap(today.year):
+        dates += ((2, 29),)
+    return dates
+
+
+def birthday_match(today: date):
+    return or_(*(
+        and_(User.birthday_month == month, User.birthday_day == day)
+        for month, day in birthday_dates(today)
+    ))
+
+
+async def _plan(session, holiday_id: int, day: date, *conditions, scope: str | None = None,
+                window: tuple = (None, None)) -> int:
+    # не ставим повторно тех, кто уже в outbox на этот день (в любом статусе)
+    queued = (
+        select(OutboxMessage.id)
+        .where(
+            OutboxMessage.user_id == User.id,
+            OutboxMessage.holiday_id == holiday_id,
+            OutboxMessage.day == day,
+        )
+        .exists()
+    )
+    source = select(
+        User.id,
+        literal(holiday_id, Integer),
+        literal(day, Date),
+        func.coalesce(User.lang, "ru"),
+        literal(PENDING, String),
+        literal(0, Integer),
+        literal(window[0], TIMESTAMP(timezone=True)),
+        literal(window[1], TIMESTAMP(timezone=True)),
+    ).where(*conditions, ~queued)
+    if scope is not None:
+        # аудитория — подписчики календаря: проход идёт от первичного ключа user_scopes
+        # (scope, user_id), поэтому праздник небольшого календаря не читает всю таблицу users
+        source = (
+            source.select_from(UserScope)
+            .join(User, User.id == UserScope.user_id)
+            .where(UserScope.scope == scope)
+        )
+    if session.bind.dialect.name == "postgresql":
+        # держится до конца транзакции; второй воркер дождётся и не найдёт, что вставлять
+        await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PLAN_LOCK_KEY})
+    res = await session.execute(_insert_ignore(session).from_select(_COLUMNS, source))
+    return res.rowcount
+
+
+def _sent_in_year(holiday_id: int, year: int) -> tuple:
+    # ровно префикс уникального индекса (holiday_id, year, user_id): прошлые годы не читаются
+    return (
+        Notification.holiday_id == holiday_id,
+        Notification.year == year,
+        Notification.user_id == User.id,
+    )
+
+
+async def plan_holiday(session, holiday_id: int, day: date, *conditions, scope: str | None = None,
+                       window: tuple = (None, None)) -> int:
+    """
+    Одним INSERT ... SELECT ставит в outbox всех ещё не поздравленных с праздником.
+    scope — только подписчики этого календаря; conditions дополнительно ограничивают
+    аудиторию (например, часовыми поясами); window — (начало, конец) окна отправки в UTC.
+    """
+    already_sent = (
+        select(Notification.id)
+        .where(*_sent_in_year(holiday_id, day.year))
+        .exists()
+    )
+    return await _plan(session, holiday_id, day, *conditions, ~already_sent, scope=scope, window=window)
+
+
+async def plan_birthdays(session, birthday_holiday_id: int, day: date, *conditions,
+                         window: tuple = (None, None)) -> int:
+    """Ставит в outbox сегодняшних именинников, которых ещё не поздравляли в этом году."""
+    already_sent = (
+        select(Notification.id)
+        .where(*_sent_in_year(birthday_holiday_id, day.year))
+        .exists()
+    )
+    return await _plan(session, birthday_holiday_id, day, birthday_match(day), *conditions, ~already_sent,
+                       window=window)
+
+
+async def has_pending(session) -> bool:
+    res = await session.execute(
+        select(OutboxMessage.id).where(_claimable(datetime.now(pytz.utc))).limit(1)
+    )
+    return res.first() is not None
+
+
+async def count_pending(session) -> int:
+    res = await session.execute(
+        select(func.count(OutboxMessage.id)).where(_claimable(datetime.now(pytz.utc)))
+    )
+    return res.scalar_one()
+
+
+async def next_due_at(session) -> datetime | None:
+    """
+    Когда outbox снова понадобится разбирать: ближайшее начало окна или повтор ожидающей
+    строки, либо конец чужой аренды. None — незавершённых строк с открытым окном нет.
+    """
+    now = datetime.now(pytz.utc)
+    due = case(
+        (OutboxMessage.status == PENDING,
+         func.coalesce(OutboxMessage.available_at, literal(now, TIMESTAMP(timezone=True)))),
+        else_=func.coalesce(OutboxMessage.lease_until, literal(now, TIMESTAMP(timezone=True))),
+    )
+    res = await session.execute(
+        select(func.min(due)).where(OutboxMessage.status.in_((PENDING, SENDING)), _open(now))
+    )
+    return _utc(res.scalar_one())
+
+
+async def claim_batch(session, limit: int, owner: str, lease_seconds: float) -> list:
+    """
+    Берёт в аренду до limit строк (pending -> sending) одним UPDATE ... RETURNING
+    и возвращает их вместе с tg_id и именем получателя; attempts — с учётом этой попытки.
+    На PostgreSQL строки выбираются через FOR UPDATE SKIP LOCKED, поэтому параллельные
+    воркеры получают непересекающиеся пачки. SQLite пишет в один поток, и сам UPDATE атомарен.
+    """
+    now = datetime.now(pytz.utc)
+    claimable_ids = (
+        select(OutboxMessage.id)
+        .where(_claimable(now))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    res = await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(claimable_ids), _claimable(now))
+        .values(
+            status=SENDING,
+            attempts=OutboxMessage.attempts + 1,
+            lease_owner=owner,
+            lease_until=now + timedelta(seconds=lease_seconds),
+            available_at=None,
+            updated_at=now,
+        )
+        .returning(OutboxMessage.id)
+    )
+    ids = res.scalars().all()
+    if not ids:
+        return []
+
+    res = await session.execute(
+        select(
+            OutboxMessage.id,
+            OutboxMessage.user_id,
+            OutboxMessage.holiday_id,
+            OutboxMessage.day,
+            OutboxMessage.lang,
+            OutboxMessage.attempts,
+            OutboxMessage.expires_at,
+            User.tg_id,
+            User.name,
+        )
+        .join(User, User.id == OutboxMessage.user_id)
+        .where(OutboxMessage.id.in_(ids))
+        .order_by(OutboxMessage.id)
+    )
+    return res.all()
+
+
+async def mark_failed(session, failed, max_attempts: int, retry_base: float, retry_max: float) -> int:
+    """
+    Разбирает неудачные отправки; failed — список пар (row, текст ошибки).
+    Временная ошибка (текст начинается с "retryable:") возвращает строку в pending
+    с экспоненциальной задержкой available_at; failed — постоянные ошибки, строки,
+    исчерпавшие max_attempts попыток, и те, чей повтор вышел бы за окно отправки.
+    Возвращает число строк, поставленных на повтор.
+    """
+    if not failed:
+        return 0
+    now = datetime.now(pytz.utc)
+    values = []
+    for row, error in failed:
+        item = {"id": row.id, "error": error[:500], "lease_owner": None, "lease_until": None, "updated_at": now}
+        retry_at = now + timedelta(seconds=min(retry_base * 2 ** (row.attempts - 1), retry_max))
+        expires_at = _utc(row.expires_at)
+        if (error.startswith("retryable:") and row.attempts < max_attempts
+                and (expires_at is None or retry_at < expires_at)):
+            item.update(status=PENDING, available_at=retry_at)
+        else:
+            item.update(status=FAILED, available_at=None)
+        values.append(item)
+    await session.execute(update(OutboxMessage), values)
+    return sum(item["status"] == PENDING for item in values)
+
+
+async def expire(session) -> int:
+    """
+    Помечает failed неотправленные строки, окно отправки которых закрылось (прошедший
+    день, простой процесса, повторы до конца окна). Строки под живой арендой не трогает.
+    """
+    now = datetime.now(pytz.utc)
+    res = await session.execute(
+        update(OutboxMessage)
+        .where(
+            ~_open(now),
+            or_(
+                OutboxMessage.status == PENDING,
+                and_(
+                    OutboxMessage.status == SENDING,
+                    or_(OutboxMessage.lease_until.is_(None), OutboxMessage.lease_until < now),
+                ),
+            ),
+        )
+        .values(status=FAILED, error="expired: окно отправки закрылось",
+                lease_owner=None, lease_until=None, updated_at=now)
+    )
+    return res.rowcount
+
+
+async def prune(session, before: date) -> int:
+    """Удаляет завершённые строки outbox старше указанного дня."""
+    res = await session.execute(
+        delete(OutboxMessage).where(
+            OutboxMessage.day < before,
+            OutboxMessage.status.in_([SENT, FAILED]),
+        )
+    )
+    return res.rowcount
@@ -0,0 +1,153 @@
+"""
+Правила повторения праздников (Holiday.rule) и их развёртка в конкретные даты.
+
+    ""                      — каждый год в (month, day) праздника
+    "easter:orthodox+39"    — православная Пасха со сдвигом в днях (easter:western — западная)
+    "nth:fri:-1"            — последняя пятница месяца праздника (nth:mon:2 — второй понедельник)
+    "hijri:12-10"           — 10 зу-ль-хиджа (Курбан айт) по табличному исламскому календарю;
+                              с официальной датой может расходиться на день
+    "dates:2025-06-06,2026-05-27" — явный список дат (официально объявленные)
+
+К любому правилу можно добавить ";observed": праздник, выпавший на субботу или
+воскресенье, переносится на понедельник. Для fixed и nth месяц берётся из праздника,
+для остальных правил month и day праздника не используются.
+"""
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+# 1 мухаррама 1 года хиджры (16 июля 622 по юлианскому календарю) в днях date.toordinal()
+_ISLAMIC_EPOCH = 227015
+
+_EASTER = re.compile(r"^easter:(orthodox|western)([+-]\d{1,3})?$")
+_NTH = re.compile(r"^nth:(mon|tue|wed|thu|fri|sat|sun):(-?[1-5])$")
+_HIJRI = re.compile(r"^hijri:(\d{1,2})-(\d{1,2})$")
+
+
+class RuleError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Rule:
+    kind: str  # fixed / easter / nth / hijri / dates
+    args: tuple = ()
+    observed: bool = False
+
+    @property
+    def uses_month(self) -> bool:
+        return self.kind in ("fixed", "nth")
+
+    @property
+    def uses_day(self) -> bool:
+        return self.kind == "fixed"
+
+
+def parse_rule(text: str | None) -> Rule:
+    """Разбирает Holiday.rule; RuleError, если правило не распознано."""
+    base, *modifiers = [part.strip() for part in (text or "").lower().split(";")]
+    observed = False
+    for modifier in modifiers:
+        if modifier != "observed":
+            raise RuleError(f"неизвестный модификатор правила: {modifier!r}")
+        observed = True
+    if base == "observed" and not modifiers:
+        base, observed = "", True
+
+    if base in ("", "fixed"):
+        return Rule("fixed", (), observed)
+    if m := _EASTER.match(base):
+        return Rule("easter", (m.group(1), int(m.group(2) or 0)), observed)
+    if m := _NTH.match(base):
+        return Rule("nth", (WEEKDAYS[m.group(1)], int(m.group(2))), observed)
+    if m := _HIJRI.match(base):
+        month, day = int(m.group(1)), int(m.group(2))
+        if not (1 <= month <= 12 and 1 <= day <= 30):
+            raise RuleError(f"нет такой даты исламского календаря: {base!r}")
+        return Rule("hijri", (month, day), observed)
+    if base.startswith("dates:"):
+        try:
+            dates = tuple(sorted({date.fromisoformat(item.strip()) for item in base[6:].split(",") if item.strip()}))
+        except ValueError:
+            raise RuleError(f"даты в правиле должны быть в виде YYYY-MM-DD: {base!r}") from None
+        if not dates:
+            raise RuleError("пустой список дат")
+        return Rule("dates", dates, observed)
+    raise RuleError(f"неизвестное правило: {base!r}")
+
+
+def western_easter(year: int) -> date:
+    # анонимный григорианский алгоритм (Meeus/Jones/Butcher)
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def orthodox_easter(year: int) -> date:
+    # алгоритм Меёса для юлианского календаря и перевод в григорианский
+    a, b, c = year % 4, year % 7, year % 19
+    d = (19 * c + 15) % 30
+    e = (2 * a + 4 * b - d + 34) % 7
+    month, day = divmod(d + e + 114, 31)
+    return date(year, month, day + 1) + timedelta(days=year // 100 - year // 400 - 2)
+
+
+def hijri_to_date(year: int, month: int, day: int) -> date:
+    """Дата табличного (арифметического) исламского календаря в григорианском."""
+    ordinal = (_ISLAMIC_EPOCH - 1 + (year - 1) * 354 + (3 + 11 * year) // 30
+               + 29 * (month - 1) + month // 2 + day)
+    return date.fromordinal(ordinal)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date | None:
+    if n > 0:
+        first = date(year, month, 1)
+        result = first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    else:
+        last = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1))
+        result = last - timedelta(days=(last.weekday() - weekday) % 7 + 7 * (-n - 1))
+    return result if result.month == month else None
+
+
+def _base_dates(rule: Rule, month: int, day: int, year: int) -> list:
+    if rule.kind == "fixed":
+        try:
+            return [date(year, month, day)]
+        except ValueError:
+            # 29 февраля в невисокосный год пропускается
+            if (month, day) == (2, 29):
+                return []
+            raise RuleError(f"нет такой даты: месяц {month}, день {day}") from None
+    if rule.kind == "easter":
+        flavour, shift = rule.args
+        easter = orthodox_easter(year) if flavour == "orthodox" else western_easter(year)
+        return [easter + timedelta(days=shift)]
+    if rule.kind == "nth":
+        if not 1 <= month <= 12:
+            raise RuleError(f"для правила nth нужен месяц праздника, а не {month}")
+        found = _nth_weekday(year, month, *rule.args)
+        return [found] if found else []
+    if rule.kind == "hijri":
+        # исламский год короче григорианского: в один год может попасть 0, 1 или 2 даты
+        approx = (year - 622) * 33 // 32
+        found = (hijri_to_date(hy, *rule.args) for hy in range(approx - 1, approx + 3))
+        return [d for d in found if d.year == year]
+    if rule.kind == "dates":
+        return [d for d in rule.args if d.year == year]
+    raise RuleError(f"неизвестный вид правила: {rule.kind}")
+
+
+def dates_in_year(rule: Rule, month: int, day: int, year: int) -> list:
+    """Даты праздника в году year (с переносом выходных для observed)."""
+    result = _base_dates(rule, month, day, year)
+    if rule.observed:
+        result = [d + timedelta(days=7 - d.weekday()) if d.weekday() >= 5 else d for d in result]
+    return result
@@ -0,0 +1,80 @@
+import asyncio, os
+from collections import OrderedDict
+from datetime import date, timedelta
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+
+
+class ResponseCache:
+    """
+    Готовые тексты ответов по ключу (день, язык, команда, ...): ответ зависит только от
+    этого и от версии календаря. День входит в ключ, поэтому после полуночи старые
+    записи просто перестают находиться и вычищаются; смена версии календаря очищает всё.
+    Одновременные промахи по одному ключу ждут одно вычисление (single-flight).
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._version = None
+        self._newest_day = None
+
+    def _rotate(self, day: date, version: int):
+        if version != self._version:
+            self._data.clear()
+            self._version = version
+        if self._newest_day is None or day > self._newest_day:
+            self._newest_day = day
+            # у пользователей из западных поясов ещё может быть вчера
+            border = day - timedelta(days=1)
+            for key in [key for key in self._data if key[0] < border]:
+                del self._data[key]
+
+    async def get(self, key: tuple, compute, version: int) -> str:
+        """key[0] — день; compute — корутинная функция без аргументов, возвращающая текст."""
+        self._rotate(key[0], version)
+        text = self._data.get(key)
+        if text is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return text
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        try:
+            text = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+
+        if version == self._version:
+            self._data[key] = text
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return text
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0,
+        }
+
+
+response_cache = ResponseCache()
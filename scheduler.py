@@ -1,12 +1,18 @@
-import asyncio, os, pytz
-from datetime import datetime, date, time
+import asyncio, os, socket, pytz
+from datetime import datetime, timedelta, time, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from sqlalchemy import select, and_, delete
-from sqlalchemy.orm import selectinload
-from db import async_session
-from models import Holiday, User, Notification
+from sqlalchemy import select, delete, or_, func
+from db import engine, async_session, read_session
+from models import User, Notification, CensusChange
 from bot import bot, _format_holiday_name, t
+from calendar_cache import get_calendar, bump_calendar_version
+from occurrences import refresh_occurrences
+from sender import is_retryable
+from ledger import NotificationLedger, prune_notifications
+from users import CENSUS_CHANNEL, on_census_change
+import outbox
+import metrics
 
 load_dotenv()
 
@@ -14,81 +20,459 @@ TIMEZONE = os.getenv("TIMEZONE", "Asia/Almaty")
 SEND_HOUR_START = int(os.getenv("SEND_HOUR_START", 9))
 SEND_HOUR_END = int(os.getenv("SEND_HOUR_END", 21))
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", 50))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+# сколько секунд воркер владеет взятой пачкой; потом её может забрать другой
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 300))
+# сколько раз пробовать доставку при временных ошибках и задержка повтора: BASE, 2·BASE, ... до MAX секунд
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", 60))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", 3600))
+# сколько прошлых лет журнала notifications хранить; более старые удаляются (или уходят в архив)
+NOTIFICATION_RETENTION_YEARS = int(os.getenv("NOTIFICATION_RETENTION_YEARS", 1))
+NOTIFICATION_ARCHIVE = os.getenv("NOTIFICATION_ARCHIVE", "0") == "1"
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# события перечитываются с запасом: транзакция, начатая раньше, могла закоммититься позже
+CENSUS_EVENT_GRACE = float(os.getenv("CENSUS_EVENT_GRACE", 300))
+
+_scheduler = None
+# смещение от UTC в минутах -> часовые пояса пользователей с этим смещением
+_buckets = {}
+# пояса, в которых есть пользователи (TIMEZONE — всегда)
+_zones = set()
+# (пояс, месяц ДР, день ДР) -> число именинников
+_census = {}
+# (пояс, месяц ДР, день ДР) -> ревизия, растущая с каждым событием по этому ключу:
+# замена одного именинника другим не меняет число, но меняет ревизию
+_census_revisions = {}
+_census_revision = 0
+# с какого момента (по часам БД) читать события переписи; None — перепись ещё не загружена
+_census_since = None
+# id уже учтённых событий -> когда учтены; события окна CENSUS_EVENT_GRACE читаются повторно
+_census_seen = {}
+# PostgreSQL: соединение, слушающее CENSUS_CHANNEL
+_census_listener = None
+# смещение -> (местный день, версия календаря), для которых праздники уже разложены в outbox
+_planned = {}
+# смещение -> (местный день, ревизия переписи именинников), для которых разложены дни рождения
+_planned_birthdays = {}
+# смещение -> блокировка: задача группы и догоняющий запуск из refresh_buckets не пересекаются
+_bucket_locks = {}
+_drain_lock = asyncio.Lock()
+# пока шёл drain, в outbox могли поставить новые строки
+_drain_again = False
+# успешные доставки пишутся в notifications пачками
+_ledger = NotificationLedger()
 
 
 async def send_notification(user, text):
-    if getattr(user, "tg_id", None):
-        try:
-            await bot.send_message(user.tg_id, text)
-        except Exception:
-            pass
+    """
+    Отправляет сообщение через общий движок (лимиты и повторы — внутри него).
+    Возвращает None при успехе или текст ошибки с её классом: retryable/permanent.
+    """
+    try:
+        await bot.send_message(user.tg_id, text)
+        return None
+    except Exception as e:
+        kind = "retryable" if is_retryable(e) else "permanent"
+        return f"{kind}: {e.__class__.__name__}: {e}"
+
 
+def _render(calendar, row, bodies: dict) -> str:
+    """
+    Текст для строки outbox. Поздравление с праздником зависит только от (праздник, язык),
+    поэтому собирается один раз за прогон и хранится в bodies.
+    """
+    key = (row.holiday_id, row.lang)
+    body = bodies.get(key)
+    if body is not None:
+        return body
+    holiday = calendar.by_id.get(row.holiday_id)
+    if holiday is not None and holiday.type == "birthday":
+        # в поздравлении имя получателя — такой текст не переиспользуется
+        return t("birthday_notifications", row.lang, user=row)
+    name = _format_holiday_name(holiday, row.lang) if holiday is not None else "Holiday"
+    body = bodies[key] = f"🎉 {name}!"
+    return body
 
-async def send_holiday_notifications():
-    tz = pytz.timezone(TIMEZONE)
-    now = datetime.now(tz)
-    if not (SEND_HOUR_START <= now.hour < SEND_HOUR_END):
+
+async def drain_outbox():
+    """
+    Отправляет всё, что ждёт в outbox. Если очередь пуста — это один дешёвый запрос.
+    В процессе одновременно работает только один drain; несколько процессов
+    делят очередь через аренду строк (см. outbox.claim_batch).
+    Вызов во время идущего drain не ждёт, а просит его сделать ещё один круг.
+    """
+    global _drain_again
+    if _drain_lock.locked():
+        metrics.drain_skipped.inc()
+        _drain_again = True
         return
 
-    today = date.today()
+    async with _drain_lock:
+        try:
+            while True:
+                _drain_again = False
+                await _drain()
+                if not _drain_again:
+                    break
+        finally:
+            await _rearm_drain()
+
+
+async def _drain():
     async with async_session() as session:
-        # Подгружаем переводы вместе с праздниками (EAGER LOADING)
-        holidays_result = await session.execute(
-            select(Holiday)
-            .options(selectinload(Holiday.translations))
-            .where(and_(Holiday.day == today.day, Holiday.month == today.month))
-        )
-        holidays = holidays_result.scalars().all()
-        if not holidays:
+        if not await outbox.has_pending(session):
+            metrics.outbox_pending.set(0)
+            # хвост буфера, оставшийся после ошибки прошлого прогона
+            await _ledger.flush()
             return
+        metrics.outbox_pending.set(await outbox.count_pending(session))
 
-        for holiday in holidays:
-            last_id = 0
-            while True:
-                result = await session.execute(
-                    select(User)
-                    .outerjoin(
-                        Notification,
-                        and_(
-                            User.id == Notification.user_id,
-                            Notification.holiday_id == holiday.id
-                        )
-                    )
-                    .where(Notification.id == None, User.id > last_id)
-                    .order_by(User.id)
-                    .limit(BATCH_SIZE)
-                )
-                batch = result.scalars().all()
-                if not batch:
-                    break
+    calendar = await get_calendar()
+    bodies = {}
+    while True:
+        async with async_session() as session:
+            batch = await outbox.claim_batch(session, BATCH_SIZE, WORKER_ID, OUTBOX_LEASE_SECONDS)
+            await session.commit()
+        if not batch:
+            break
+
+        errors = await asyncio.gather(*[send_notification(row, _render(calendar, row, bodies)) for row in batch])
+        failed = []
+        for row, error in zip(batch, errors):
+            if error is None:
+                _ledger.add(row.user_id, row.holiday_id, outbox_id=row.id, year=row.day.year)
+                metrics.fanout_sent.inc(holiday=row.holiday_id)
+            else:
+                print(f"Ошибка отправки пользователю {row.user_id} (праздник {row.holiday_id}): {error}")
+                failed.append((row, error))
+                metrics.fanout_failed.inc(holiday=row.holiday_id, kind=error.split(":", 1)[0])
 
-                tasks = []
-                for user in batch:
-                    holiday_name = _format_holiday_name(holiday, user.lang)
-                    tasks.append(send_notification(user, f"🎉 {holiday_name}!"))
-                if tasks:
-                    await asyncio.gather(*tasks)
-                    await asyncio.sleep(0.3)
-
-                session.add_all([
-                    Notification(user_id=user.id, holiday_id=holiday.id)
-                    for user in batch
-                ])
+        if failed:
+            async with async_session() as session:
+                retried = await outbox.mark_failed(session, failed, OUTBOX_MAX_ATTEMPTS,
+                                                   OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX)
                 await session.commit()
-                last_id = batch[-1].id
+            if retried:
+                print(f"Отложено до повтора: {retried} из {len(failed)}")
+        await _ledger.maybe_flush()
 
-async def check_birthdays():
-    today = date.today()
+    await _ledger.flush()
 
+
+async def _rearm_drain():
+    """
+    Регулярного опроса outbox нет: если после прогона остались незавершённые строки,
+    следующий drain ставится на ближайшее из начала их окна отправки, повтора после
+    временной ошибки и истечения чужой аренды. Хвост буфера журнала — через OUTBOX_LEASE_SECONDS.
+    """
+    if _scheduler is None:
+        return
     async with async_session() as session:
-        # 1. Получаем id специального праздника "birthday"
-        q = await session.execute(
-            select(Holiday).where(Holiday.type == "birthday")
+        due = await outbox.next_due_at(session)
+    now = datetime.now(pytz.utc)
+    if len(_ledger):
+        tail = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        due = min(due, tail) if due is not None else tail
+    if due is not None:
+        _schedule_drain(max(due, now))
+
+
+def _schedule_drain(run_date: datetime):
+    if _scheduler is not None:
+        _scheduler.add_job(drain_outbox, "date", run_date=run_date, id="drain",
+                           replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+
+def _fixed(offset: int) -> timezone:
+    return timezone(timedelta(minutes=offset))
+
+
+def _zone_filter(zones):
+    """Пользователи из перечисленных поясов; без пояса — значит TIMEZONE."""
+    cond = User.tz.in_(zones)
+    if TIMEZONE in zones:
+        cond = or_(cond, User.tz.is_(None))
+    return cond
+
+
+def _birthdays_on(zones, day) -> int:
+    """Сколько именинников в этих поясах в данный день — по переписи, без запроса к БД."""
+    return sum(
+        _census.get((zone, month, mday), 0)
+        for zone in zones
+        for month, mday in outbox.birthday_dates(day)
+    )
+
+
+def _birthday_revision(zones, day) -> int:
+    """Ревизия переписи именинников этих поясов в данный день: меняется с любым из них."""
+    return max((
+        _census_revisions.get((zone, month, mday), 0)
+        for zone in zones
+        for month, mday in outbox.birthday_dates(day)
+    ), default=0)
+
+
+def _next_due(offset: int, calendar, now: datetime):
+    """
+    Ближайший момент (UTC), когда группе поясов есть что разложить: сегодня — если окно
+    отправки ещё открыто и план изменился (новая версия календаря, событие переписи именинников),
+    иначе SEND_HOUR_START первого дня с праздником или днём рождения. None — в ближайший
+    год ничего нет.
+    """
+    zones = _buckets[offset]
+    tz = _fixed(offset)
+    local = now.astimezone(tz)
+    for shift in range(367):
+        day = local.date() + timedelta(days=shift)
+        holidays = bool(calendar.on(day))
+        birthdays = _birthdays_on(zones, day) if calendar.birthday is not None else 0
+        if not (holidays or birthdays):
+            continue
+        start = datetime.combine(day, time(SEND_HOUR_START), tzinfo=tz)
+        if shift:
+            return start.astimezone(pytz.utc)
+        if local.hour >= SEND_HOUR_END:
+            continue
+        if (holidays and _planned.get(offset) != (day, calendar.version)) or (
+                birthdays and _planned_birthdays.get(offset) != (day, _birthday_revision(zones, day))):
+            return max(start, local).astimezone(pytz.utc)
+    return None
+
+
+def _arm(offset: int, due):
+    """Одна задача-«будильник» на группу: срабатывает в due или снимается, если ждать нечего."""
+    if _scheduler is None:
+        return
+    job_id = f"bucket:{offset}"
+    if due is None:
+        if _scheduler.get_job(job_id) is not None:
+            _scheduler.remove_job(job_id)
+        return
+    # misfire_grace_time=None: после простоя процесса просроченный запуск всё равно выполняется
+    _scheduler.add_job(plan_bucket, "date", run_date=due, args=[offset], id=job_id,
+                       replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+
+async def plan_bucket(offset: int):
+    """
+    Раскладывает в outbox праздники и дни рождения пользователей одного смещения от UTC
+    (в минутах), отправляет их и заводит будильник на следующее событие группы.
+    «Сегодня» и окно отправки считаются по местному времени.
+    """
+    lock = _bucket_locks.setdefault(offset, asyncio.Lock())
+    if lock.locked():
+        return
+    async with lock:
+        zones = _buckets.get(offset)
+        if not zones:
+            return
+        # Праздники берём из общего снимка календаря (переводы уже внутри)
+        calendar = await get_calendar()
+        now = datetime.now(_fixed(offset))
+        if SEND_HOUR_START <= now.hour < SEND_HOUR_END:
+            await _plan_today(offset, zones, now, calendar)
+            # очередь общая: заодно отправляем то, что поставили другие воркеры
+            await drain_outbox()
+        _arm(offset, _next_due(offset, calendar, datetime.now(pytz.utc)))
+
+
+async def _plan_today(offset: int, zones, now: datetime, calendar):
+    today = now.date()
+    audience = _zone_filter(zones)
+    # окно отправки сегодняшнего дня группы: после SEND_HOUR_END строки не отправляются
+    midnight = datetime.combine(today, time(0), tzinfo=_fixed(offset))
+    window = (midnight + timedelta(hours=SEND_HOUR_START), midnight + timedelta(hours=SEND_HOUR_END))
+    # раз в день на пояс: вся аудитория праздника одним INSERT ... SELECT
+    holidays = calendar.on(today) if _planned.get(offset) != (today, calendar.version) else ()
+    # именинников перепланируем после каждого события переписи по их дню — дату могли указать
+    # или сменить в течение дня; INSERT ... SELECT не ставит уже поставленных повторно
+    birthdays = _birthdays_on(zones, today) if calendar.birthday is not None else 0
+    revision = _birthday_revision(zones, today)
+    plan_birthdays = birthdays and _planned_birthdays.get(offset) != (today, revision)
+
+    if holidays or plan_birthdays:
+        async with async_session() as session:
+            for holiday in holidays:
+                # только подписчики календаря праздника из этой группы поясов
+                count = await outbox.plan_holiday(session, holiday.id, today, audience, scope=holiday.scope,
+                                                 window=window)
+                print(f"Праздник {holiday.id} ({holiday.scope}), UTC{offset:+d} мин: в очередь поставлено {count}")
+                metrics.fanout_planned.inc(count, holiday=holiday.id)
+            if plan_birthdays:
+                count = await outbox.plan_birthdays(session, calendar.birthday.id, today, audience, window=window)
+                metrics.fanout_planned.inc(count, holiday=calendar.birthday.id)
+            await session.commit()
+    _planned[offset] = (today, calendar.version)
+    if plan_birthdays:
+        _planned_birthdays[offset] = (today, revision)
+
+
+async def load_census():
+    """
+    Полная перепись пользователей (пояс, месяц и день рождения) одним групповым запросом.
+    Выполняется при старте; дальше перепись ведут события (refresh_census).
+    """
+    global _zones, _census, _census_since
+    await _listen_census()
+    # перепись терпит отставание реплики
+    async with read_session() as session:
+        since = (await session.execute(select(func.now()))).scalar_one()
+        res = await session.execute(
+            select(User.tz, User.birthday_month, User.birthday_day, func.count())
+            .group_by(User.tz, User.birthday_month, User.birthday_day)
         )
-        birthday_holiday = q.scalar_one()
+        zones, census = {TIMEZONE}, {}
+        for zone, month, day, count in res.all():
+            zone = zone or TIMEZONE
+            zones.add(zone)
+            if month is not None:
+                key = (zone, month, day)
+                census[key] = census.get(key, 0) + count
+    _zones, _census, _census_since = zones, census, since
+    _census_seen.clear()
 
-        # 2. Чистим уведомления для тех, у кого дата рождения стерта
-        # (например, пользователь очистил свой ДР)
+
+def _schedule_census():
+    # несколько событий подряд сливаются в один запуск
+    if _scheduler is not None:
+        _scheduler.add_job(refresh_census, "date", run_date=datetime.now(pytz.utc), id="census",
+                           replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+
+async def _listen_census():
+    """
+    PostgreSQL: события переписи из других процессов приходят через LISTEN/NOTIFY
+    на отдельном соединении. Оборвавшееся соединение заменяется при часовом refresh_buckets.
+    """
+    global _census_listener
+    if engine.dialect.name != "postgresql":
+        return
+    if _census_listener is not None:
+        raw = await _census_listener.get_raw_connection()
+        if not raw.driver_connection.is_closed():
+            return
+        await _census_listener.invalidate()
+    conn = await engine.connect()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.add_listener(CENSUS_CHANNEL, lambda *args: _schedule_census())
+    _census_listener = conn
+
+
+async def refresh_census():
+    """
+    Применяет свежие события переписи (CensusChange): по индексам пересчитывает только
+    затронутые пояса и дни рождения, а не всю таблицу users. Группам поясов, которых это
+    касается, будильник перезаводится — новый именинник получит поздравление в тот же день.
+    Запускается по событию (коммит в этом процессе или NOTIFY из другого), а не по таймеру.
+    """
+    global _census_since, _census_revision
+    if _census_since is None:
+        return
+    # читаем с основной базы: событие только что закоммичено, реплика могла не догнать
+    async with async_session() as session:
+        now_db = (await session.execute(select(func.now()))).scalar_one()
+        res = await session.execute(
+            select(CensusChange.id, CensusChange.tz, CensusChange.birthday_month, CensusChange.birthday_day)
+            .where(CensusChange.created_at >= _census_since - timedelta(seconds=CENSUS_EVENT_GRACE))
+        )
+        fresh = [row for row in res.all() if row.id not in _census_seen]
+        keys = {(row.tz or TIMEZONE, row.birthday_month, row.birthday_day) for row in fresh}
+
+        zones_changed = False
+        for zone in {zone for zone, _, _ in keys} - {TIMEZONE}:
+            present = (await session.execute(select(User.id).where(User.tz == zone).limit(1))).first() is not None
+            if present != (zone in _zones):
+                zones_changed = True
+                (_zones.add if present else _zones.discard)(zone)
+        for key in keys:
+            zone, month, day = key
+            if month is None:
+                continue
+            count = (await session.execute(
+                select(func.count(User.id))
+                .where(User.birthday_month == month, User.birthday_day == day, _zone_filter([zone]))
+            )).scalar_one()
+            if count:
+                _census[key] = count
+            else:
+                _census.pop(key, None)
+            _census_revision += 1
+            _census_revisions[key] = _census_revision
+
+    for row in fresh:
+        _census_seen[row.id] = now_db
+    for event_id, seen_at in list(_census_seen.items()):
+        if seen_at < now_db - timedelta(seconds=2 * CENSUS_EVENT_GRACE):
+            del _census_seen[event_id]
+    _census_since = now_db
+    if not keys:
+        return
+
+    now = datetime.now(pytz.utc)
+    if zones_changed:
+        _regroup(now)
+    touched = {zone for zone, _, _ in keys}
+    await _rearm_buckets([offset for offset, zones in _buckets.items() if touched & set(zones)], now)
+
+
+def _regroup(now: datetime):
+    """Группирует пояса переписи по их текущему смещению от UTC (с учётом летнего времени)."""
+    global _buckets
+    buckets = {}
+    for zone in sorted(_zones):
+        try:
+            local = now.astimezone(pytz.timezone(zone))
+        except pytz.UnknownTimeZoneError:
+            print(f"Неизвестный часовой пояс в users.tz: {zone}")
+            continue
+        offset = int(local.utcoffset().total_seconds() // 60)
+        buckets.setdefault(offset, []).append(zone)
+    _buckets = buckets
+
+    if _scheduler is not None:
+        for job in _scheduler.get_jobs():
+            if job.id.startswith("bucket:") and int(job.id[len("bucket:"):]) not in buckets:
+                job.remove()
+
+
+async def _rearm_buckets(offsets, now: datetime):
+    # группы, у которых событие уже наступило (например, после рестарта), догоняются сразу
+    calendar = await get_calendar()
+    for offset in offsets:
+        due = _next_due(offset, calendar, now)
+        if due is not None and due <= now:
+            await plan_bucket(offset)
+        else:
+            _arm(offset, due)
+
+
+async def refresh_buckets():
+    """
+    Раз в час пересобирает группы поясов по текущему смещению (учитывая переход на летнее
+    время) и заводит каждой группе будильник на её ближайшее событие. Запрос к users —
+    только при первом запуске (load_census); дальше перепись ведут события, а здесь
+    лишь дочитываются пропущенные (процессы на SQLite без NOTIFY, обрыв слушателя).
+    """
+    if _census_since is None:
+        await load_census()
+    else:
+        await _listen_census()
+        await refresh_census()
+    now = datetime.now(pytz.utc)
+    _regroup(now)
+    await _rearm_buckets(list(_buckets), now)
+
+
+async def cleanup_birthday_notifications():
+    """Раз в сутки чистим уведомления о ДР у тех, кто стёр дату рождения."""
+    calendar = await get_calendar()
+    birthday_holiday = calendar.birthday
+    if birthday_holiday is None:
+        return
+
+    async with async_session() as session:
         await session.execute(
             delete(Notification).where(
                 Notification.holiday_id == birthday_holiday.id,
@@ -99,51 +483,62 @@ async def check_birthdays():
         )
         await session.commit()
 
-        # 3. Ищем всех пользователей, у кого совпадает день и месяц
-        q = await session.execute(
-            select(User).where(User.birthday.isnot(None))
-        )
-        users = q.scalars().all()
-
-        for user in users:
-            if (
-                user.birthday
-                and user.birthday.day == today.day
-                and user.birthday.month == today.month
-            ):
-                # 4. Проверяем — было ли уже уведомление сегодня
-                qn = await session.execute(
-                    select(Notification).where(
-                        Notification.user_id == user.id,
-                        Notification.holiday_id == birthday_holiday.id,
-                        Notification.sent_at >= datetime.combine(today, time.min),
-                    )
-                )
-                exists = qn.first()
-                if exists:
-                    continue  # уже было сегодня
-
-                # 5. Отправляем сообщение
-                text = t("birthday_notifications", user.lang, user=user)
-                try:
-                    await bot.send_message(user.tg_id, text)
-                except Exception as e:
-                    print(f"Ошибка отправки ДР пользователя {user.id}: {e}")
-                    continue
-
-                # 6. Записываем новое уведомление
-                notif = Notification(
-                    user_id=user.id,
-                    holiday_id=birthday_holiday.id,
-                    sent_at=datetime.now(),
-                )
-                session.add(notif)
 
+async def prune_outbox():
+    today = datetime.now(pytz.timezone(TIMEZONE)).date()
+    async with async_session() as session:
+        expired = await outbox.expire(session)
+        await outbox.prune(session, today - timedelta(days=OUTBOX_RETENTION_DAYS))
+        # события переписи нужны, пока их не прочитали все планировщики
+        await session.execute(delete(CensusChange).where(
+            CensusChange.created_at < datetime.now(pytz.utc) - timedelta(days=1)))
+        await session.commit()
+    if expired:
+        print(f"Не отправлено до конца окна: {expired}")
+
+
+async def refresh_holiday_occurrences():
+    """
+    Раз в сутки сверяет holiday_occurrences с правилами праздников: с новым годом окно
+    сдвигается, недостающие годы дописываются, прошедшие удаляются. Если что-то
+    изменилось — поднимает версию календаря, чтобы процессы перечитали снимок.
+    """
+    today = datetime.now(pytz.timezone(TIMEZONE)).date()
+    async with async_session() as session:
+        changed = await refresh_occurrences(session, today=today)
+        if changed:
+            await bump_calendar_version(session)
         await session.commit()
+    if changed:
+        print(f"Даты праздников обновлены: {changed} строк")
+
+
+async def prune_notification_ledger():
+    """Раз в месяц убирает из журнала годы старше NOTIFICATION_RETENTION_YEARS."""
+    before_year = datetime.now(pytz.timezone(TIMEZONE)).year - NOTIFICATION_RETENTION_YEARS
+    async with async_session() as session:
+        count = await prune_notifications(session, before_year, archive=NOTIFICATION_ARCHIVE)
+        await session.commit()
+    if count:
+        action = "перенесено в архив" if NOTIFICATION_ARCHIVE else "удалено"
+        print(f"Журнал уведомлений до {before_year} года: {action} {count}")
+
 
 def start_scheduler():
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-    scheduler.add_job(send_holiday_notifications, "cron", minute="*")
-    scheduler.add_job(check_birthdays, "cron", minute="*")
+    global _scheduler
+    scheduler = _scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+    metrics.instrument_scheduler(scheduler)
+    # перепись при старте и будильники групп поясов: сразу (догоняем пропущенное) и далее раз в час
+    scheduler.add_job(refresh_buckets, "cron", minute=0, next_run_time=datetime.now(pytz.utc))
+    # изменения поясов и дней рождения — по событиям, без полного пересчёта и без опроса
+    on_census_change(_schedule_census)
+    # хвост outbox после рестарта; дальше drain заводится только при новых строках
+    _schedule_drain(datetime.now(pytz.utc))
+    scheduler.add_job(cleanup_birthday_notifications, "cron", hour=3, minute=0)
+    # даты переходящих праздников на годы вперёд: при старте (после простоя) и каждую ночь
+    scheduler.add_job(refresh_holiday_occurrences, "cron", hour=3, minute=15,
+                      next_run_time=datetime.now(pytz.utc))
+    scheduler.add_job(prune_outbox, "cron", hour=3, minute=30)
+    scheduler.add_job(prune_notification_ledger, "cron", day=1, hour=3, minute=45)
     scheduler.start()
-    print("Scheduler started!")
\ No newline at end of file
+    print("Scheduler started!")
@@ -1,6 +1,6 @@
 import asyncio
-from db import async_session, engine, Base
-from models import Holiday, HolidayTranslation
+from db import init_db, dispose_engines
+from holiday_import import BIRTHDAY as BIRTHDAY_TYPE, build_record, import_records
 
 BIRTHDAY = {
     "translations": {
@@ -20,51 +20,28 @@ HOLIDAYS = [
     {"day": 6, "month": 7, "translations": {"ru": "День столицы", "kk": "Астана күні", "en": "Capital Day"}},
     {"day": 30, "month": 8, "translations": {"ru": "День Конституции", "kk": "Конституция күні", "en": "Constitution Day"}},
     {"day": 25, "month": 10, "translations": {"ru": "День Республики", "kk": "Республика күні", "en": "Republic Day"}},
-    {"day": 12, "month": 16, "translations": {"ru": "День независимости", "kk": "Тәуелсіздік күні", "en": "Independence Day"}},
+    {"day": 16, "month": 12, "translations": {"ru": "День независимости", "kk": "Тәуелсіздік күні", "en": "Independence Day"}},
+    # переходящие: дата по правилу (recurrence.py), month и day не нужны
+    {"rule": "hijri:12-10", "translations": {"ru": "Курбан айт", "kk": "Құрбан айт", "en": "Eid al-Adha"}},
 ]
 
-async def seed():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-    async with async_session() as session:
-        # создаём специальный «праздник» для ДР
-        q = await session.execute(Holiday.__table__.select().where(Holiday.type == "birthday"))
-        exists = q.first()
-
-        if not exists:
-            holiday = Holiday(day=0, month=0, type="birthday")
-            session.add(holiday)
-            await session.flush()
-
-            for lang, name in BIRTHDAY["translations"].items():
-                session.add(
-                    HolidayTranslation(holiday_id=holiday.id, lang=lang, name=name)
-                )
+def _records():
+    # создаём специальный «праздник» для ДР
+    yield build_record(0, 0, BIRTHDAY["translations"], type=BIRTHDAY_TYPE)
+    # обычные праздники
+    for h in HOLIDAYS:
+        yield build_record(h.get("month", 0), h.get("day", 0), h["translations"],
+                           type=h.get("type", "regular"), rule=h.get("rule", ""))
 
-        # обычные праздники
-        for h in HOLIDAYS:
-            q = await session.execute(
-                Holiday.__table__.select().where(
-                    Holiday.day == h["day"],
-                    Holiday.month == h["month"],
-                    Holiday.scope == "kz"
-                )
-            )
-            if q.first():
-                continue
 
-            holiday = Holiday(day=h["day"], month=h["month"], type=h.get("type", "regular"))
-            session.add(holiday)
-            await session.flush()
-
-            for lang, name in h["translations"].items():
-                session.add(
-                    HolidayTranslation(holiday_id=holiday.id, lang=lang, name=name)
-                )
-
-        await session.commit()
-    print("Holidays seeded (idempotent).")
+async def seed():
+    await init_db()
+    try:
+        # upsert по (scope, month, day, rule): повторный запуск ничего не дублирует
+        stats = await import_records(_records())
+    finally:
+        await dispose_engines()
+    print(f"Holidays seeded (idempotent): создано {stats['created']}, обновлено {stats['updated']}.")
 
 if __name__ == "__main__":
     asyncio.run(seed())
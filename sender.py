@@ -0,0 +1,178 @@
+import asyncio, os, random, time
+from collections import OrderedDict, deque
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+    TelegramEntityTooLarge,
+)
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_GLOBAL_BURST = float(os.getenv("SEND_GLOBAL_BURST", 30))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+SEND_CHAT_BUCKETS = int(os.getenv("SEND_CHAT_BUCKETS", 10000))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+SEND_BACKOFF_BASE = float(os.getenv("SEND_BACKOFF_BASE", 0.5))
+SEND_BACKOFF_MAX = float(os.getenv("SEND_BACKOFF_MAX", 30))
+
+# За сколько секунд хранить отметки успешных отправок для расчёта throughput
+_RECENT_WINDOW = 60.0
+
+# Методы, которые создают сообщения в чате и попадают под лимиты
+_RATE_LIMITED_PREFIXES = ("Send", "Copy", "Forward")
+
+
+class TokenBucket:
+    """
+    Token bucket без блокировок: в одном event loop проверка и списание атомарны.
+    Токены можно «занять в долг» — reserve() вернёт, сколько подождать.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, n: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def reserve(self, n: float = 1) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self, n: float = 1):
+        wait = self.reserve(n)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Временные ошибки, после которых имеет смысл повторить запрос."""
+    if isinstance(error, TelegramEntityTooLarge):
+        return False
+    return isinstance(error, (TelegramRetryAfter, TelegramNetworkError, TelegramServerError, asyncio.TimeoutError))
+
+
+class SendEngine(BaseRequestMiddleware):
+    """
+    Общий движок исходящих запросов к Bot API (request middleware сессии бота):
+    глобальный и по-чатовые token bucket'ы, уважение RetryAfter, повторы временных
+    ошибок с экспоненциальной задержкой и счётчики для мониторинга.
+    """
+
+    def __init__(self,
+                 global_rate: float = SEND_GLOBAL_RATE,
+                 global_burst: float = SEND_GLOBAL_BURST,
+                 chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = OrderedDict()
+        self._paused_until = 0.0
+        self._recent = deque()
+
+        self.attempts = 0
+        self.sent = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.failed_retryable = 0
+        self.failed_permanent = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > SEND_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_turn(self, method):
+        # после flood wait весь бот молчит, пока Telegram не разрешит снова
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if not type(method).__name__.startswith(_RATE_LIMITED_PREFIXES):
+            return
+        chat_id = getattr(method, "chat_id", None)
+        wait = self.global_bucket.reserve()
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id).reserve())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __call__(self, make_request, bot, method):
+        # long polling повторяет запросы сам
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        attempt = 0
+        while True:
+            await self._wait_turn(method)
+            attempt += 1
+            self.attempts += 1
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if attempt > self.max_retries:
+                    self.failed_retryable += 1
+                    raise
+                self.retries += 1
+                continue
+            except Exception as e:
+                if not is_retryable(e):
+                    self.failed_permanent += 1
+                    raise
+                if attempt > self.max_retries:
+                    self.failed_retryable += 1
+                    raise
+                self.retries += 1
+                delay = min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+
+            self.sent += 1
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent[0] < now - _RECENT_WINDOW:
+                self._recent.popleft()
+            return result
+
+    def throughput(self, window: float = 10.0) -> float:
+        """Успешных запросов в секунду за последние window (не больше 60) секунд."""
+        window = min(window, _RECENT_WINDOW)
+        border = time.monotonic() - window
+        return sum(1 for ts in self._recent if ts >= border) / window
+
+    def stats(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "sent": self.sent,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "failed_retryable": self.failed_retryable,
+            "failed_permanent": self.failed_permanent,
+            "throughput": self.throughput(),
+        }
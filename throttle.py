@@ -0,0 +1,134 @@
+import asyncio, os, time
+from collections import OrderedDict
+from aiogram import BaseMiddleware, types
+from aiogram.exceptions import TelegramAPIError
+from dotenv import load_dotenv
+from sender import TokenBucket
+
+load_dotenv()
+
+# апдейтов в секунду от одного пользователя и запас на короткую серию; 0 — без ограничения
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", 1))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", 5))
+# сколько секунд апдейт может подождать токен; дольше — отбрасывается
+THROTTLE_MAX_DELAY = float(os.getenv("THROTTLE_MAX_DELAY", 2))
+# одинаковые колбэки одного пользователя в этом окне обрабатываются один раз
+THROTTLE_COALESCE_SECONDS = float(os.getenv("THROTTLE_COALESCE_SECONDS", 1))
+# сколько пользователей помнить; самые давние забываются (их ведро снова полное)
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", 10000))
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """
+    Outer-middleware aiogram перед UserSessionMiddleware: отсекает лишние апдейты
+    до того, как они дойдут до БД и Bot API.
+
+    У каждого пользователя своё ведро токенов (sender.TokenBucket). Апдейт без
+    токена ждёт его не дольше THROTTLE_MAX_DELAY, иначе отбрасывается. Повтор того же
+    колбэка (двойное нажатие кнопки), пока первый обрабатывается или не прошло
+    THROTTLE_COALESCE_SECONDS, склеивается с ним: хендлер не вызывается. Сообщения
+    не склеиваются — одинаковый текст может быть осознанным повтором команды.
+    На отброшенный или склеенный колбэк бот всё равно отвечает, иначе кнопка
+    «крутится» у пользователя до таймаута Telegram.
+    """
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: float = THROTTLE_BURST,
+                 max_delay: float = THROTTLE_MAX_DELAY, coalesce: float = THROTTLE_COALESCE_SECONDS,
+                 max_users: int = THROTTLE_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.coalesce = coalesce
+        self.max_users = max_users
+        self.passed = 0
+        self.delayed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._buckets = OrderedDict()
+        # (tg_id, данные колбэка) -> до какого момента повтор склеивается; None — первый ещё в работе
+        self._recent = {}
+
+    def _bucket(self, tg_id: int) -> TokenBucket:
+        bucket = self._buckets.get(tg_id)
+        if bucket is None:
+            bucket = self._buckets[tg_id] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(tg_id)
+        return bucket
+
+    @staticmethod
+    def _key(tg_id: int, event):
+        if isinstance(event, types.CallbackQuery) and event.data:
+            return tg_id, event.data
+        return None
+
+    @staticmethod
+    async def _skip(event):
+        if isinstance(event, types.CallbackQuery):
+            try:
+                await event.answer()
+            except TelegramAPIError as e:
+                # колбэк мог устареть — апдейт всё равно отбрасываем
+                print(f"Не удалось ответить на отброшенный колбэк: {e}")
+        return None
+
+    def _is_repeat(self, key, now: float) -> bool:
+        if key not in self._recent:
+            return False
+        until = self._recent[key]
+        if until is None or until > now:
+            return True
+        del self._recent[key]
+        return False
+
+    def _forget_expired(self, now: float):
+        # чистим, только когда записей стало много: обычно их единицы
+        if len(self._recent) > self.max_users:
+            for key, until in list(self._recent.items()):
+                if until is not None and until <= now:
+                    del self._recent[key]
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user is None or self.rate <= 0:
+            return await handler(event, data)
+
+        key = self._key(from_user.id, event) if self.coalesce > 0 else None
+        if key is not None and self._is_repeat(key, time.monotonic()):
+            self.coalesced += 1
+            return await self._skip(event)
+
+        bucket = self._bucket(from_user.id)
+        if not bucket.try_acquire():
+            wait = bucket.reserve()
+            if wait > self.max_delay:
+                # токен не дождаться — возвращаем занятое и отбрасываем апдейт
+                bucket.tokens += 1
+                self.dropped += 1
+                return await self._skip(event)
+            self.delayed += 1
+            if key is not None:
+                self._recent[key] = None
+            await asyncio.sleep(wait)
+        self.passed += 1
+
+        if key is None:
+            return await handler(event, data)
+        self._recent[key] = None
+        try:
+            return await handler(event, data)
+        finally:
+            now = time.monotonic()
+            self._recent[key] = now + self.coalesce
+            self._forget_expired(now)
+
+    def stats(self) -> dict:
+        return {
+            "passed": self.passed,
+            "delayed": self.delayed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "users": len(self._buckets),
+        }
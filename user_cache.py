@@ -0,0 +1,84 @@
+import os, time
+from collections import OrderedDict
+from models import User
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 600))
+
+
+class UserProfile:
+    """Компактная копия строки users — без ORM-состояния и ленивых связей."""
+    __slots__ = ("id", "tg_id", "name", "lang", "birthday", "tz", "scopes")
+
+    def __init__(self, id, tg_id, name, lang, birthday, tz=None, scopes=()):
+        self.id = id
+        self.tg_id = tg_id
+        self.name = name
+        self.lang = lang or "ru"
+        self.birthday = birthday
+        self.tz = tz
+        # календари, на которые подписан пользователь; отсортированный tuple — годится в ключ кэша
+        self.scopes = tuple(sorted(scopes))
+
+    @classmethod
+    def from_model(cls, user: User, scopes=()) -> "UserProfile":
+        return cls(user.id, user.tg_id, user.name, user.lang, user.birthday, user.tz, scopes)
+
+
+class UserCache:
+    """LRU-кэш профилей по tg_id с ограничением размера и временем жизни записи."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, tg_id: int) -> UserProfile | None:
+        item = self._data.get(tg_id)
+        if item is not None:
+            profile, expires_at = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(tg_id)
+                self.hits += 1
+                return profile
+            del self._data[tg_id]
+        self.misses += 1
+        return None
+
+    def peek(self, tg_id: int) -> UserProfile | None:
+        """Профиль без учёта в статистике и без продления записи — для пересборки после записи."""
+        item = self._data.get(tg_id)
+        return item[0] if item is not None else None
+
+    def put(self, profile: UserProfile):
+        self._data[profile.tg_id] = (profile, time.monotonic() + self.ttl)
+        self._data.move_to_end(profile.tg_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, tg_id: int):
+        self._data.pop(tg_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+user_cache = UserCache()
+
+
+def remember_profile(profile: UserProfile) -> UserProfile:
+    """Обновляет кэш после записи в users и возвращает тот же профиль."""
+    user_cache.put(profile)
+    return profile
@@ -0,0 +1,196 @@
+import os
+from aiogram import BaseMiddleware
+from sqlalchemy import insert, select, update, delete, event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from db import async_session
+from models import User, UserScope, CensusChange
+from user_cache import UserProfile, user_cache, remember_profile
+
+# календари (Holiday.scope), на которые подписывается новый пользователь
+DEFAULT_SCOPES = tuple(s.strip() for s in os.getenv("DEFAULT_SCOPES", "kz").split(",") if s.strip())
+
+_PROFILE_COLUMNS = (User.id, User.tg_id, User.name, User.lang, User.birthday, User.tz)
+# поля, по которым планировщик считает перепись (пояс и день рождения)
+_CENSUS_COLUMNS = (User.tz, User.birthday_month, User.birthday_day)
+# канал PostgreSQL NOTIFY, по которому планировщики других процессов узнают о событиях переписи
+CENSUS_CHANNEL = "user_census"
+# подписчики этого процесса (планировщик): вызываются после коммита события переписи
+_census_hooks = []
+
+
+def on_census_change(callback):
+    """Регистрирует callback() — его вызовут после коммита смены пояса или дня рождения."""
+    _census_hooks.append(callback)
+
+
+def _run_census_hooks(_session):
+    for callback in _census_hooks:
+        callback()
+
+
+async def load_scopes(session, user_id: int) -> tuple:
+    res = await session.execute(select(UserScope.scope).where(UserScope.user_id == user_id))
+    return tuple(res.scalars().all())
+
+
+def _insert_scopes(session, rows):
+    # подписка уже есть (повтор, параллельный апдейт) — не ошибка
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(UserScope).values(rows).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(UserScope).values(rows).on_conflict_do_nothing()
+    return insert(UserScope).values(rows)
+
+
+def _census_key(profile: UserProfile) -> tuple:
+    birthday = profile.birthday
+    return profile.tz, birthday.month if birthday else None, birthday.day if birthday else None
+
+
+async def _record_census_change(session, before, profile: UserProfile):
+    # старое и новое состояние: планировщик пересчитает оба ключа (см. CensusChange)
+    after = _census_key(profile)
+    if before is not None and tuple(before) == after:
+        return
+    keys = [after] if before is None else [tuple(before), after]
+    await session.execute(insert(CensusChange), [
+        {"tz": tz, "birthday_month": month, "birthday_day": day} for tz, month, day in keys
+    ])
+    if session.bind.dialect.name == "postgresql":
+        # доставляется слушателям только при коммите этой транзакции
+        await session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": CENSUS_CHANNEL})
+    if _census_hooks:
+        event.listen(session.sync_session, "after_commit", _run_census_hooks, once=True)
+
+
+def _with_birthday_parts(changes: dict) -> dict:
+    # Core-запрос минует @validates модели, поэтому месяц и день ДР пишем сами
+    if "birthday" in changes:
+        birthday = changes["birthday"]
+        changes = dict(changes,
+                       birthday_month=birthday.month if birthday else None,
+                       birthday_day=birthday.day if birthday else None)
+    return changes
+
+
+async def upsert_user(session, tg_id: int, name: str, scopes: tuple | None = None, **changes) -> UserProfile:
+    """
+    Создаёт пользователя или меняет его поля одним INSERT ... ON CONFLICT (tg_id)
+    DO UPDATE ... RETURNING. Без changes существующая строка не меняется, но возвращается.
+    Подписки (scopes) не меняются: если не переданы, берутся из кэша профиля или читаются.
+    Смена пояса или дня рождения пишет событие переписи для планировщика.
+    Коммит — за вызывающим; кэш профилей обновляется сразу.
+    """
+    census_changed = "tz" in changes or "birthday" in changes
+    before = None
+    if census_changed:
+        before = (await session.execute(
+            select(*_CENSUS_COLUMNS).where(User.tg_id == tg_id).with_for_update()
+        )).first()
+    changes = _with_birthday_parts(changes)
+    dialect = session.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(User).values(tg_id=tg_id, name=name, **changes)
+        # пустой SET недопустим — «обновляем» tg_id тем же значением, чтобы RETURNING вернул строку
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            set_={key: stmt.excluded[key] for key in changes} or {"tg_id": stmt.excluded.tg_id},
+        ).returning(*_PROFILE_COLUMNS)
+        row = (await session.execute(stmt)).one()
+    else:
+        row = (await session.execute(select(*_PROFILE_COLUMNS).where(User.tg_id == tg_id))).first()
+        if row is None:
+            await session.execute(insert(User).values(tg_id=tg_id, name=name, **changes))
+        elif changes:
+            await session.execute(update(User).where(User.tg_id == tg_id).values(**changes))
+        row = (await session.execute(select(*_PROFILE_COLUMNS).where(User.tg_id == tg_id))).one()
+    if scopes is None:
+        cached = user_cache.peek(tg_id)
+        scopes = cached.scopes if cached is not None and cached.id == row.id else await load_scopes(session, row.id)
+    profile = UserProfile(*row, scopes=scopes)
+    if census_changed:
+        await _record_census_change(session, before, profile)
+    return remember_profile(profile)
+
+
+async def set_scope(session, profile: UserProfile, scope: str, subscribed: bool) -> UserProfile:
+    """Подписывает на календарь scope или отписывает от него. Коммит — за вызывающим."""
+    if subscribed:
+        await session.execute(_insert_scopes(session, [{"scope": scope, "user_id": profile.id}]))
+        scopes = {*profile.scopes, scope}
+    else:
+        await session.execute(
+            delete(UserScope).where(UserScope.user_id == profile.id, UserScope.scope == scope)
+        )
+        scopes = set(profile.scopes) - {scope}
+    return remember_profile(UserProfile(profile.id, profile.tg_id, profile.name, profile.lang,
+                                        profile.birthday, profile.tz, scopes))
+
+
+async def load_user(session, tg_id: int, for_update: bool = False) -> UserProfile | None:
+    """
+    Строка пользователя вместе с подписками одним запросом, мимо кэша; кэш обновляется.
+    for_update блокирует строку users до конца транзакции (на PostgreSQL) — так
+    параллельные изменения одного пользователя не читают одно и то же старое состояние.
+    """
+    stmt = (
+        select(*_PROFILE_COLUMNS, UserScope.scope)
+        .outerjoin(UserScope, UserScope.user_id == User.id)
+        .where(User.tg_id == tg_id)
+    )
+    if for_update:
+        stmt = stmt.with_for_update(of=User)
+    rows = (await session.execute(stmt)).all()
+    if not rows:
+        return None
+    scopes = [row.scope for row in rows if row.scope is not None]
+    return remember_profile(UserProfile(*rows[0][:-1], scopes=scopes))
+
+
+async def fresh_user(session, profile: UserProfile, for_update: bool = False) -> UserProfile:
+    """
+    Профиль прямо из БД для хендлеров, которые показывают или меняют его поля.
+    Кэш профилей у каждого процесса свой: после изменения на другом экземпляре
+    (вебхук за балансировщиком, несколько ботов) он отстаёт до USER_CACHE_TTL.
+    for_update — только там, где по прочитанному решают, что записать; блокировку
+    снимает коммит, и его стоит сделать до обращений к Telegram.
+    """
+    return await load_user(session, profile.tg_id, for_update=for_update) or profile
+
+
+async def resolve_user(session, tg_id: int, name: str) -> UserProfile:
+    """
+    Профиль из кэша; иначе строка вместе с подписками одним запросом; новому
+    пользователю — upsert (без гонок) и подписка на DEFAULT_SCOPES.
+    """
+    profile = user_cache.get(tg_id)
+    if profile is not None:
+        return profile
+    profile = await load_user(session, tg_id)
+    if profile is not None:
+        return profile
+    profile = await upsert_user(session, tg_id, name, scopes=DEFAULT_SCOPES)
+    if DEFAULT_SCOPES:
+        rows = [{"scope": scope, "user_id": profile.id} for scope in DEFAULT_SCOPES]
+        await session.execute(_insert_scopes(session, rows))
+    await session.commit()
+    return profile
+
+
+class UserSessionMiddleware(BaseMiddleware):
+    """
+    Outer-middleware aiogram: одна сессия БД на апдейт (data["session"]) и профиль
+    отправителя (data["user"], см. resolve_user).
+    Сессия подключается к БД только при первом запросе, так что апдейт,
+    обслуженный из кэшей, не занимает соединение.
+    """
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        async with async_session() as session:
+            data["session"] = session
+            if from_user is not None:
+                data["user"] = await resolve_user(session, from_user.id, from_user.full_name)
+            return await handler(event, data)
@@ -0,0 +1,148 @@
+import asyncio, hmac, os, signal
+from aiohttp import web
+from aiogram import types
+from dotenv import load_dotenv
+from metrics import metrics_handler
+
+load_dotenv()
+
+# Публичный адрес, на который Telegram шлёт апдейты (без пути). Пусто — вебхук
+# у Telegram не регистрируется: удобно для локальной проверки curl'ом.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# сколько апдейтов один процесс обрабатывает одновременно
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 100))
+# сколько секунд при остановке ждём уже принятые апдейты
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """
+    Принимает апдейты POST-запросами и передаёт их в dp.feed_update.
+    Одновременно обрабатывается не больше max_concurrency апдейтов: сверх лимита запрос
+    ждёт свободного места, и Telegram (или балансировщик) сам притормаживает поток.
+    Ответ 200 отдаётся сразу после постановки в работу, обработка идёт в фоне.
+    """
+
+    def __init__(self, dp, bot, secret: str = WEBHOOK_SECRET, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.closing = False
+        self.received = 0
+        self.failed = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(_SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self.closing:
+            # процесс останавливается — пусть Telegram повторит запрос на другой экземпляр
+            return web.Response(status=503)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"Некорректный апдейт: {e}")
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        if self.closing:
+            # остановка началась, пока запрос ждал места, — новых задач уже не берём
+            self._slots.release()
+            return web.Response(status=503)
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            print(f"Ошибка обработки апдейта {update.update_id}: {e.__class__.__name__}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Перестаёт принимать апдейты и ждёт уже принятые (не дольше timeout секунд)."""
+        self.closing = True
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            print(f"Не дождались {len(pending)} апдейтов за {timeout} с — отменяем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def health(self, request: web.Request) -> web.Response:
+        # для балансировщика: 503, пока процесс сливает очередь перед остановкой
+        return web.json_response(
+            {"in_flight": len(self._tasks), "received": self.received, "failed": self.failed},
+            status=503 if self.closing else 200,
+        )
+
+
+def build_app(dp, bot, handler: WebhookHandler | None = None) -> web.Application:
+    handler = handler or WebhookHandler(dp, bot)
+    app = web.Application()
+    app["webhook_handler"] = handler
+    app.router.add_post(WEBHOOK_PATH, handler.handle)
+    app.router.add_get("/healthz", handler.health)
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+
+async def run_webhook(dp, bot, stop: asyncio.Event | None = None):
+    """
+    Поднимает HTTP-сервер и работает до stop (по умолчанию — до SIGINT/SIGTERM).
+    Экземпляров можно запустить несколько за балансировщиком: setWebhook идемпотентен,
+    а хендлеры, которые меняют пользователя по его текущим полям, перечитывают профиль
+    из БД (users.fresh_user). Остальные ответы берут профиль из кэша своего процесса
+    и после изменения на другом экземпляре отстают не дольше USER_CACHE_TTL.
+    """
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # без секрета апдейты на публичный адрес может прислать кто угодно
+        raise RuntimeError("WEBHOOK_URL задан без WEBHOOK_SECRET — вебхук не регистрируем")
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # Windows: остаётся обычный KeyboardInterrupt
+                pass
+
+    handler = WebhookHandler(dp, bot)
+    runner = web.AppRunner(build_app(dp, bot, handler))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await dp.emit_startup(bot=bot)
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=min(100, WEBHOOK_MAX_CONCURRENCY),
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    print(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await stop.wait()
+    finally:
+        # сначала сливаем принятые апдейты, потом закрываем сервер; вебхук у Telegram
+        # не удаляем — остальные экземпляры продолжают работать
+        await handler.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
@@ -0,0 +1,21 @@
+import asyncio
+from db import init_db, engine
+from calendar_cache import load_calendar
+from scheduler import start_scheduler, WORKER_ID
+import metrics
+
+
+async def main():
+    # Отдельный процесс рассылки без приёма апдейтов. Таких воркеров можно запустить
+    # несколько: строки outbox они делят через аренду (на PostgreSQL — SKIP LOCKED).
+    await init_db()
+    await load_calendar()
+    if engine.dialect.name == "sqlite":
+        print("SQLite: запись идёт в один поток, дополнительные воркеры не ускорят рассылку.")
+    await metrics.start_server()
+    start_scheduler()
+    print(f"Worker {WORKER_ID} started")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    asyncio.run(main())